@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+#  This work is based on original code developed and copyrighted by TNO 2025.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+# Microbenchmark of the MQTT message codec: decoding a createBid payload, dispatching on the topic and encoding
+# the bid response. Run from the repository root with: python -m benchmarks.codec_benchmark
+
+import json
+import struct
+import timeit
+
+from tno.essim_battery.essim_codec import BidEncoder, decode_bid, decode_payload, get_topic_command, orjson
+
+TOPIC = "essim/node/BATT1/createBid"
+PAYLOAD = json.dumps({
+    "timeStamp": 1546300800,
+    "minPrice": 0,
+    "timeStepInSeconds": 3600,
+    "maxPrice": 1,
+    "carrierId": "29903bc6-f798-4eb8-beb9-48862bec646b"
+}).encode("utf-8")
+BID_CURVE = [[0.0, 7200000.0], [0.199999, 7199999.999999], [0.2, 1e-06], [0.8, -1e-06],
+             [0.800001, -7199999.999999], [1.0, -7200000.0]]
+NUMBER = 100000
+
+
+def legacy_round_trip():
+    topic = str(TOPIC)
+    if topic.endswith("/config"):
+        pass
+    elif topic.endswith("/createBid"):
+        payload_json = json.loads(PAYLOAD.decode("utf-8"))
+        response = struct.pack(">q", payload_json["timeStamp"])
+        for b in BID_CURVE:
+            response = response + struct.pack(">dd", b[0], b[1])
+        return response
+
+
+encoder = BidEncoder()
+handlers = {"config": None, "createBid": True, "allocate": None, "stop": None}
+
+
+def codec_round_trip():
+    if handlers.get(get_topic_command(TOPIC)):
+        payload_json = decode_payload(PAYLOAD)
+        return encoder.encode(payload_json["timeStamp"], BID_CURVE)
+
+
+if __name__ == "__main__":
+    assert legacy_round_trip() == codec_round_trip()
+    assert decode_bid(codec_round_trip()) == (1546300800, BID_CURVE)
+
+    print(f"JSON decoder: {'orjson' if orjson is not None else 'json (stdlib)'}")
+    for name, fn in [("legacy", legacy_round_trip), ("codec", codec_round_trip)]:
+        best = min(timeit.repeat(fn, number=NUMBER, repeat=5))
+        print(f"{name:>8}: {best / NUMBER * 1e6:.2f} us/message")
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+#  This work is based on original code developed and copyrighted by TNO 2025.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+# Benchmark of a whole simulation: config, createBid, allocate and stop messages are fed to an ESSIMMQTTClient
+# through an in-process fake MQTT client, and results are written to a stub InfluxDB. Reports the latency per
+# message type, the throughput and the peak memory for every simulation length. Run from the repository root with:
+#   python -m benchmarks.simulation_benchmark [--steps 1000 10000 100000]
+# The results are stored as benchmarks/results/<commit>.json, compare two runs with:
+#   python -m benchmarks.simulation_benchmark --compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from tno.essim_battery.essim_mqtt_client import ESSIMMQTTClient
+
+ESDL_PATH = os.path.join(os.path.dirname(__file__), "..", "docs", "experiment_simple", "PV-ED-BATT.esdl")
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+NODE_ID = "BATT1"
+CARRIER_ID = "7cb62d99-354a-4875-8a0f-284014270a42"
+START_DATETIME = datetime(2019, 1, 1, tzinfo=timezone.utc)
+TIME_STEP = 3600
+TIME_WINDOWS = {
+    "chargeTimeWindows": {"always_charge_below_fill_fraction": "0.25",
+                          "windows": [{"start_hour": "12", "end_hour": "24"}]},
+    "dischargeTimeWindows": {"always_discharge_above_fill_fraction": "0.75",
+                             "windows": [{"start_hour": "7", "end_hour": "10"}, {"start_hour": "18", "end_hour": "23"}]},
+}
+
+
+class Message:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class FakeMQTTClient:
+    """ Stands in for the paho client, counts the published bids. """
+
+    def __init__(self):
+        self.published_messages = 0
+        self.published_bytes = 0
+
+    def publish(self, topic, payload, *args, **kwargs):
+        self.published_messages += 1
+        self.published_bytes += len(payload)
+
+
+class StubInfluxDB:
+    """ Stands in for InfluxDBConnector, counts the written points. """
+
+    def __init__(self):
+        self.points_written = 0
+
+    def write(self, points):
+        self.points_written += len(points)
+
+    def write_lines(self, lines):
+        self.points_written += len(lines)
+
+    def query(self, query):
+        return None
+
+
+def create_messages(number_of_steps, seed=1):
+    """ Create the config message and the createBid and allocate messages of every step. """
+    with open(ESDL_PATH, encoding="utf-8") as f:
+        esdl_contents = base64.b64encode(f.read().encode("utf-8")).decode("ascii")
+    end_datetime = START_DATETIME + timedelta(seconds=(number_of_steps - 1) * TIME_STEP)
+    config = {
+        "esdlContents": esdl_contents,
+        "simulationId": "benchmark",
+        "config": {
+            "scenarioID": "benchmark",
+            "startDate": START_DATETIME.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "endDate": end_datetime.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            **TIME_WINDOWS,
+        },
+    }
+    topic = f"essim/node/{NODE_ID}"
+    config_message = Message(f"{topic}/config", json.dumps(config).encode("utf-8"))
+
+    rnd = random.Random(seed)
+    start_timestamp = int(START_DATETIME.timestamp())
+    step_messages = list()
+    for step_nr in range(number_of_steps):
+        timestamp = start_timestamp + step_nr * TIME_STEP
+        step_messages.append(Message(f"{topic}/createBid", json.dumps({
+            "timeStamp": timestamp, "minPrice": 0, "timeStepInSeconds": TIME_STEP, "maxPrice": 1,
+            "carrierId": CARRIER_ID}).encode("utf-8")))
+        step_messages.append(Message(f"{topic}/allocate", json.dumps({
+            "timeStamp": timestamp, "price": rnd.random(), "carrierId": CARRIER_ID}).encode("utf-8")))
+    stop_message = Message(f"{topic}/stop", json.dumps({"carrierId": CARRIER_ID}).encode("utf-8"))
+    return config_message, step_messages, stop_message
+
+
+def run_simulation(messages, measure_memory=False):
+    config_message, step_messages, stop_message = messages
+    essim_client = ESSIMMQTTClient("localhost")
+    essim_client.topic = "essim"
+    essim_client.node_ids = [NODE_ID]
+    mqtt_client = FakeMQTTClient()
+    influxdb = StubInfluxDB()
+
+    if measure_memory:
+        tracemalloc.start()
+    essim_client.on_message(mqtt_client, None, config_message)
+    essim_client.nodes[NODE_ID].influxdb_client = influxdb
+
+    latencies = np.empty(len(step_messages), dtype=np.int64)
+    start = time.perf_counter()
+    for i, message in enumerate(step_messages):
+        t = time.perf_counter_ns()
+        essim_client.on_message(mqtt_client, None, message)
+        latencies[i] = time.perf_counter_ns() - t
+    step_duration = time.perf_counter() - start
+
+    t = time.perf_counter()
+    essim_client.on_message(mqtt_client, None, stop_message)
+    stop_duration = time.perf_counter() - t
+
+    peak_memory = None
+    if measure_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    if mqtt_client.published_messages != len(step_messages) // 2:
+        raise Exception(f"Expected {len(step_messages) // 2} bids, got {mqtt_client.published_messages}")
+    return latencies, step_duration, stop_duration, influxdb.points_written, peak_memory
+
+
+def summarize_latencies(latencies_ns):
+    latencies_us = latencies_ns / 1000
+    return {
+        "mean_us": float(latencies_us.mean()),
+        "p50_us": float(np.percentile(latencies_us, 50)),
+        "p99_us": float(np.percentile(latencies_us, 99)),
+        "max_us": float(latencies_us.max()),
+    }
+
+
+def run_benchmark(number_of_steps, measure_memory=True):
+    messages = create_messages(number_of_steps)
+    latencies, step_duration, stop_duration, points_written, _ = run_simulation(messages)
+    result = {
+        "steps": number_of_steps,
+        "createBid": summarize_latencies(latencies[0::2]),
+        "allocate": summarize_latencies(latencies[1::2]),
+        "messages_per_second": len(latencies) / step_duration,
+        "stop_seconds": stop_duration,
+        "points_written": points_written,
+    }
+    if measure_memory:
+        # A separate run, tracemalloc slows down the simulation
+        result["peak_memory_bytes"] = run_simulation(messages, measure_memory=True)[4]
+    return result
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_result(result):
+    memory = result.get("peak_memory_bytes")
+    print(f"{result['steps']:>7} steps: createBid p50 {result['createBid']['p50_us']:8.1f} us "
+          f"p99 {result['createBid']['p99_us']:8.1f} us | allocate p50 {result['allocate']['p50_us']:8.1f} us "
+          f"p99 {result['allocate']['p99_us']:8.1f} us | {result['messages_per_second']:9.0f} msg/s | "
+          f"stop {result['stop_seconds'] * 1000:7.1f} ms"
+          f"{f' | peak {memory / 2 ** 20:7.1f} MiB' if memory is not None else ''}")
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = {r["steps"]: r for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = {r["steps"]: r for r in json.load(f)["results"]}
+    print(f"{'steps':>7} {'metric':<22} {'old':>12} {'new':>12} {'ratio':>7}")
+    for steps in sorted(old.keys() & new.keys()):
+        metrics = [("createBid p50 us", lambda r: r["createBid"]["p50_us"]),
+                   ("createBid p99 us", lambda r: r["createBid"]["p99_us"]),
+                   ("allocate p50 us", lambda r: r["allocate"]["p50_us"]),
+                   ("allocate p99 us", lambda r: r["allocate"]["p99_us"]),
+                   ("messages/s", lambda r: r["messages_per_second"]),
+                   ("stop ms", lambda r: r["stop_seconds"] * 1000),
+                   ("peak MiB", lambda r: r["peak_memory_bytes"] / 2 ** 20 if r.get("peak_memory_bytes") else None)]
+        for name, metric in metrics:
+            old_value, new_value = metric(old[steps]), metric(new[steps])
+            if old_value is None or new_value is None:
+                continue
+            print(f"{steps:>7} {name:<22} {old_value:12.2f} {new_value:12.2f} {new_value / old_value:7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a simulation with a fake MQTT client and InfluxDB.")
+    parser.add_argument("--steps", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="the simulation lengths to benchmark")
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak memory measurement")
+    parser.add_argument("--output", help="the result file, by default benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = list()
+    for number_of_steps in args.steps:
+        result = run_benchmark(number_of_steps, measure_memory=not args.no_memory)
+        print_result(result)
+        results.append(result)
+
+    commit = get_commit()
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "date": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": results,
+        }, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
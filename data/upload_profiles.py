@@ -1,67 +1,137 @@
 # =====================================================================================================================
-#   Script to upload profile data from a CSV file
+#   Script to upload profile data from CSV files
 # =====================================================================================================================
-import csv
+#   python upload_profiles.py [--skip-uploaded] [--workers 4] [files ...]
+#
+#   Every CSV file becomes a measurement named after the file, with a field per column. The first column holds the
+#   time (day-month-year hour:minute, UTC), the other columns the values, separated by ';'.
+#   The files are parsed in parallel processes. Each file is encoded as line protocol and written in gzip compressed
+#   batches, several at a time. With --skip-uploaded, files whose content hash is recorded in the database as
+#   uploaded are skipped.
+import argparse
+import hashlib
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
 from influxdb import InfluxDBClient
-from locale import atof
-import glob, os
-import codecs
 
 db_host = "localhost"
 db_port = 8086
 db_name = 'energy_profiles'
 use_ssl = False
+batch_size = 20000
+write_workers = 4
+default_files = ["./standard_profiles.csv", "./ALPG_profile_HH2-3.csv"]
+# The content hashes of the uploaded files are recorded in this measurement
+uploads_measurement = "uploaded_files"
 
+thread_data = threading.local()
 
-def connect_database():
-    client = InfluxDBClient(host=db_host, port=db_port, database=db_name, ssl=use_ssl)
-    if db_name not in client.get_list_database():
-       client.create_database(db_name)
+
+def connect_database(create=True):
+    client = InfluxDBClient(host=db_host, port=db_port, database=db_name, ssl=use_ssl, gzip=True)
+    if create and {"name": db_name} not in client.get_list_database():
+        client.create_database(db_name)
     return client
 
 
-def format_datetime(dt):
-    date, time = dt.split(" ")
-    day, month, year = date.split("-")
-    ndate = year + "-" + month + "-" + day
-    ntime = time + ":00+0000"
-    return ndate + "T" + ntime
+def get_thread_client():
+    # One client (and HTTP session) per writer thread
+    if getattr(thread_data, "client", None) is None:
+        thread_data.client = connect_database(create=False)
+    return thread_data.client
 
 
-def process_profiles_csv(client, file_path):
-    path_parts = os.path.split(file_path)
-    file_name = path_parts[-1]
-    measurement = os.path.splitext(file_name)[0]
+def escape_key(name):
+    return str(name).replace("\\", "\\\\").replace(",", "\\,").replace(" ", "\\ ").replace("=", "\\=")
 
-    with codecs.open(file_path, encoding='utf-8-sig') as csv_file:
-        reader = csv.reader(csv_file, delimiter=';')
 
-        column_names = next(reader)
-        print(column_names)
+def get_content_hash(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
 
-        num_fields = len(column_names)
-        json_body = []
 
-        for row in reader:
-            fields = {}
-            for i in range(1, num_fields):
-                if row[i]:
-                    fields[column_names[i]] = atof(row[i])
+def is_uploaded(client, content_hash):
+    result = client.query(f"SELECT * FROM \"{uploads_measurement}\" WHERE \"sha256\" = '{content_hash}'")
+    return len(list(result.get_points())) > 0
 
-            json_body.append({
-                "measurement": measurement,
-                "time": format_datetime(row[0]),
-                "fields": fields
-            })
 
-        client.write_points(points=json_body, database=db_name, batch_size=100)
+def read_profiles_csv(file_path):
+    """ Returns the epoch timestamps (seconds) and a DataFrame with a float column per field. """
+    df = pd.read_csv(file_path, sep=";", encoding="utf-8-sig", dtype={0: str})
+    times = pd.to_datetime(df.iloc[:, 0], format="%d-%m-%Y %H:%M", utc=True)
+    timestamps = (times - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)
+    values = df.iloc[:, 1:].apply(pd.to_numeric, errors="coerce").astype(np.float64)
+    return timestamps.to_numpy(dtype=np.int64), values
 
 
-if __name__ == "__main__":
-    client = connect_database()
+def encode_lines(measurement, timestamps, values):
+    """ Encode the rows as line protocol, fields without a value are left out (like empty cells in the CSV). """
+    prefix = escape_key(measurement) + " "
+    columns = list()
+    for name in values.columns:
+        column = values[name].to_numpy()
+        strings = np.char.add(escape_key(name) + "=", column.astype(str)).astype(object)
+        strings[np.isnan(column)] = None
+        columns.append(strings)
+    suffixes = [f" {t}" for t in timestamps.tolist()]
+    if not values.isna().to_numpy().any():
+        return [prefix + ",".join(fields) + suffix for *fields, suffix in zip(*columns, suffixes)]
+    lines = list()
+    for *fields, suffix in zip(*columns, suffixes):
+        fields = [f for f in fields if f is not None]
+        if fields:
+            lines.append(prefix + ",".join(fields) + suffix)
+    return lines
+
+
+def write_batch(lines):
+    get_thread_client().write(lines, params={"db": db_name, "precision": "s"}, expected_response_code=204,
+                              protocol="line")
+    return len(lines)
+
 
-    for filename in glob.glob("./standard_profiles.csv"):
-        process_profiles_csv(client, filename)
+def process_profiles_csv(file_path, skip_uploaded=False):
+    file_name = os.path.split(file_path)[-1]
+    measurement = os.path.splitext(file_name)[0]
+    client = connect_database(create=False)
+
+    content_hash = get_content_hash(file_path)
+    if skip_uploaded and is_uploaded(client, content_hash):
+        print(f"{file_name}: already uploaded, skipped")
+        return 0
+
+    timestamps, values = read_profiles_csv(file_path)
+    print(f"{file_name}: {list(values.columns)}")
+    lines = encode_lines(measurement, timestamps, values)
+    with ThreadPoolExecutor(max_workers=write_workers) as executor:
+        written = sum(executor.map(write_batch, [lines[i:i + batch_size] for i in range(0, len(lines), batch_size)]))
 
-    for filename in glob.glob("./ALPG_profile_HH2-3.csv"):
-        process_profiles_csv(client, filename)
+    client.write_points([{
+        "measurement": uploads_measurement,
+        "tags": {"sha256": content_hash},
+        "fields": {"file": file_name, "measurement": measurement, "points": written},
+    }], database=db_name)
+    print(f"{file_name}: wrote {written} points to measurement {measurement}")
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upload profiles from CSV files to InfluxDB.")
+    parser.add_argument("files", nargs="*", default=default_files, help="the CSV files to upload")
+    parser.add_argument("--skip-uploaded", action="store_true",
+                        help="skip files with the same content as a file that was uploaded before")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="the number of files processed at once")
+    args = parser.parse_args()
+
+    connect_database()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(process_profiles_csv, file_path, args.skip_uploaded) for file_path in args.files]
+        total = sum(future.result() for future in futures)
+    print(f"Wrote {total} points")
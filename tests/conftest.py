@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+#  This work is based on original code developed and copyrighted by TNO 2025.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+# Run from the repository root with: python -m pytest tests
+import os
+
+os.environ.setdefault('LOG4P_JSON_LOCATION', os.path.join(os.path.dirname(__file__), '..', 'tno', 'shared',
+                                                          'log4p.json'))
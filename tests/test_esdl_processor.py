@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+#  This work is based on original code developed and copyrighted by TNO 2025.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+import numpy as np
+
+from tno.essim_battery.esdl_processor import ESDLProcessor
+
+START = 1546300800
+
+
+def test_time_series_starting_after_the_simulation_is_padded():
+    values = ESDLProcessor.align_time_series([1.0, 2.0], 3600, START + 7200, 3600, START)
+    np.testing.assert_array_equal(values, [np.nan, np.nan, 1.0, 2.0])
+
+
+def test_time_series_starting_before_the_simulation_is_cropped():
+    values = ESDLProcessor.align_time_series([1.0, 2.0, 3.0], 3600, START - 3600, 3600, START)
+    np.testing.assert_array_equal(values, [2.0, 3.0])
+
+
+def test_time_series_is_offset_before_it_is_resampled():
+    values = ESDLProcessor.align_time_series([1.0, 2.0, 3.0, 4.0], 900, START - 1800, 3600, START)
+    np.testing.assert_array_equal(values, [3.5])
+
+
+def test_time_series_is_offset_after_it_is_resampled():
+    values = ESDLProcessor.align_time_series([1.0, 2.0, 3.0, 4.0], 7200, START + 3600, 3600, START)
+    np.testing.assert_array_equal(values, [np.nan, 1.0, 1.0, 2.0, 2.0, 3.0, 3.0, 4.0, 4.0])
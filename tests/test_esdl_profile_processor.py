@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+#  This work is based on original code developed and copyrighted by TNO 2025.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+from datetime import datetime, timedelta
+
+import numpy as np
+from esdl import esdl
+
+from tno.essim_battery.esdl_profile_processor import ESDLProfileProcessor
+
+
+def create_processor():
+    return ESDLProfileProcessor(datetime(2019, 1, 1), datetime(2019, 1, 1, 2), timedelta(hours=1))
+
+
+def create_profile(values, timestep, physical_quantity, unit):
+    return esdl.TimeSeriesProfile(values=values, timestep=timestep, startDateTime=datetime(2019, 1, 1),
+                                  profileQuantityAndUnit=esdl.QuantityAndUnitType(physicalQuantity=physical_quantity,
+                                                                                 unit=unit))
+
+
+def test_energy_profile_is_summed_when_downsampled():
+    profile = create_profile([1.0] * 8, 900, esdl.PhysicalQuantityEnum.ENERGY, esdl.UnitEnum.JOULE)
+    np.testing.assert_array_equal(create_processor().get_profile_values(profile), [4.0, 4.0, np.nan])
+
+
+def test_energy_profile_is_split_when_upsampled():
+    profile = create_profile([8.0], 7200, esdl.PhysicalQuantityEnum.ENERGY, esdl.UnitEnum.JOULE)
+    np.testing.assert_array_equal(create_processor().get_profile_values(profile), [4.0, 4.0, np.nan])
+
+
+def test_power_profile_is_averaged_when_downsampled():
+    profile = create_profile([1.0, 2.0, 3.0, 4.0], 900, esdl.PhysicalQuantityEnum.POWER, esdl.UnitEnum.WATT)
+    np.testing.assert_array_equal(create_processor().get_profile_values(profile), [2.5 * 3600, np.nan, np.nan])
+
+
+def test_price_profile_is_averaged_when_downsampled():
+    profile = create_profile([1.0, 2.0, 3.0, 4.0], 900, esdl.PhysicalQuantityEnum.COST, esdl.UnitEnum.EURO)
+    processor = create_processor()
+    np.testing.assert_array_equal(processor.align_profile(900 * np.arange(4) + 1546300800,
+                                                          900 * np.arange(1, 5) + 1546300800, profile.values,
+                                                          ESDLProfileProcessor.is_energy(profile)),
+                                  [2.5, np.nan, np.nan])
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+#  This work is based on original code developed and copyrighted by TNO 2025.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+import numpy as np
+
+from tno.essim_battery.line_protocol import LineProtocolEncoder
+
+
+def create_encoder():
+    return LineProtocolEncoder("battery-Battery 1", {"simulationRun": "run-1"}, ["soc", "cost"])
+
+
+def test_encode():
+    assert create_encoder().encode(100, [1.5, 2.0]) == "battery-Battery\\ 1,simulationRun=run-1 soc=1.5,cost=2.0 100"
+
+
+def test_encode_skips_rows_that_are_not_finite():
+    encoder = create_encoder()
+    assert encoder.encode(100, [1.5, float("nan")]) is None
+    assert encoder.encode(100, [float("inf"), 2.0]) is None
+    assert encoder.encode(100, [1.5, -float("inf")]) is None
+
+
+def test_encode_rows_skips_rows_that_are_not_finite():
+    values = np.array([[1.0, 2.0], [np.nan, 2.0], [3.0, np.inf], [4.0, 5.0]])
+    chunks = list(create_encoder().encode_rows([100, 200, 300, 400], values, chunk_size=1))
+    assert chunks == [["battery-Battery\\ 1,simulationRun=run-1 soc=1.0,cost=2.0 100"],
+                      ["battery-Battery\\ 1,simulationRun=run-1 soc=4.0,cost=5.0 400"]]
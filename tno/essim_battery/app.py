@@ -15,7 +15,9 @@
 
 import os
 
+from tno.essim_battery.essim_async_client import AsyncESSIMMQTTClient
 from tno.essim_battery.essim_mqtt_client import ESSIMMQTTClient
+from tno.essim_battery.metrics import start_metrics_server
 
 essim_topic = "essim"
 
@@ -25,7 +27,11 @@ MQTT_USERNAME = os.getenv('MQTT_USERNAME', None)
 MQTT_PASSWORD = os.getenv('MQTT_PASSWORD', None)
 ESSIM_ID = os.getenv('ESSIM_ID', None)
 SIMULATION_ID = os.getenv('SIMULATION_ID', None)
+# A single node id, a comma separated list of node ids or '+' to host all nodes in one process
 MODEL_ID = os.getenv('MODEL_ID', 'BATT1')
+# 'thread' handles messages in the paho network thread, 'async' in an asyncio event loop with an executor for the
+# blocking work
+MQTT_CLIENT_MODE = os.getenv('MQTT_CLIENT_MODE', 'thread')
 
 print('MQTT_HOST:     ', MQTT_HOST)
 print('MQTT_PORT:     ', MQTT_PORT)
@@ -34,8 +40,10 @@ print('MQTT_PASSWORD: ', '<hidden>')
 print('ESSIM_ID:      ', ESSIM_ID)
 print('SIMULATION_ID: ', SIMULATION_ID)
 print('MODEL_ID:      ', MODEL_ID)
+print('CLIENT_MODE:   ', MQTT_CLIENT_MODE)
 
-essim_mqtt_client = ESSIMMQTTClient(
+client_class = AsyncESSIMMQTTClient if MQTT_CLIENT_MODE == 'async' else ESSIMMQTTClient
+essim_mqtt_client = client_class(
     MQTT_HOST,
     MQTT_PORT,
     mqtt_username=MQTT_USERNAME,
@@ -44,5 +52,6 @@ essim_mqtt_client = ESSIMMQTTClient(
     env_simulation_id=SIMULATION_ID,
     env_model_id=MODEL_ID
 )
-essim_mqtt_client.connect(topic=essim_topic, node_id=MODEL_ID)
+start_metrics_server()
+essim_mqtt_client.connect(topic=essim_topic, node_id=[node_id.strip() for node_id in MODEL_ID.split(',')])
 essim_mqtt_client.loop()
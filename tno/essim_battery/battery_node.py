@@ -13,102 +13,211 @@
 #  Manager:
 #      TNO
 
-from datetime import datetime
+import os
 
-from tno.shared.log import get_logger
+import numpy as np
+
+from tno.essim_battery.battery_physics import get_efficiency, get_next_state_of_charge, get_retention_factor, \
+    replay_state_of_charge
+from tno.essim_battery.line_protocol import LineProtocolEncoder
+from tno.essim_battery.lookahead import MSO_ENABLE, LookaheadStrategy
+from tno.essim_battery.time_windows import CHARGE_THRESHOLD_KEY, DISCHARGE_THRESHOLD_KEY, compile_time_windows, \
+    get_hour_of_day
+from tno.shared.log import get_logger, is_trace_step
 
 logger = get_logger(__name__)
 
+# Keep the full bid curve of every step. If disabled, only the start and end energy of each curve is kept,
+# which is all that is written to the results.
+KEEP_BID_CURVES = os.getenv('KEEP_BID_CURVES', 'true').lower() == 'true'
+MAX_BID_CURVE_POINTS = 6
+MARGINAL_COST_ATTRIBUTES = ["marginalChargeCosts", "marginalDischargeCosts"]
+
 
 class BatteryNode:
-    def __init__(self, asset_info, carriers_info, simulation_info, charge_time_windows, discharge_time_windows):
+    def __init__(self, asset_info, carriers_info, simulation_info, charge_time_windows, discharge_time_windows,
+                 keep_bid_curves=KEEP_BID_CURVES, mso_enable=MSO_ENABLE):
         self.asset_info = asset_info
         self.carriers_info = carriers_info
         self.simulation_info = simulation_info
 
         self.delta = 1e-6
 
-        self.state_of_charge_in_joules = list()
+        # Per step state, preallocated for the number of steps of the simulation:
+        # - state_of_charge_in_joules[i] is the state of charge at the start of step i
+        # - bid_curves[carrier_id][i, :bid_curve_points[carrier_id][i]] are the points of the bid curve of step i
+        # - bid_curve_energies[carrier_id][i] are the energies of the first and last point of that curve
+        # - allocations_energy[carrier_id][i] is the allocated energy of step i, NaN while not allocated
+        self.number_of_steps = max(int(self.simulation_info['number_of_steps']), 1)
+        self.keep_bid_curves = keep_bid_curves
+        self.state_of_charge_in_joules = np.zeros(self.number_of_steps + 1, dtype=np.float64)
         self.bid_curves = dict()
+        self.bid_curve_points = dict()
+        self.bid_curve_energies = dict()
         self.allocations_energy = dict()
+        # The last bid curve (step_nr, bid_curve) per carrier, used to process its allocation
+        self.current_bid_curves = dict()
         self.min_price = None
         self.max_price = None
         self.duration = None
 
         self.charge_time_windows = charge_time_windows
         self.discharge_time_windows = discharge_time_windows
+        # Charging is always allowed below the threshold fill fraction, above it only in the time windows
+        self.charge_threshold, self.charge_hours = compile_time_windows(
+            charge_time_windows, CHARGE_THRESHOLD_KEY, np.inf)
+        self.discharge_threshold, self.discharge_hours = compile_time_windows(
+            discharge_time_windows, DISCHARGE_THRESHOLD_KEY, -np.inf)
+
+        # Results are streamed to the result writer while the simulation runs, see start_result_stream
+        self.result_writer = None
+        self.line_encoder = None
+        self.simulation_run_id = None
+        self.start_timestamp = None
 
         attrs_used = ["capacity", "fillLevel", "marginalChargeCosts", "marginalDischargeCosts"]
         for attr in attrs_used:
             if attr not in self.asset_info:
                 raise Exception(f"{attr} not defined on battery asset")
 
-        self.state_of_charge_in_joules.append(self.asset_info["capacity"] * self.asset_info["fillLevel"])
-
-    def store_bid_curve(self, carried_id, bid_curve):
-        if carried_id not in self.bid_curves:
-            self.bid_curves[carried_id] = list()
-
-        self.bid_curves[carried_id].append(bid_curve)
-
-    def store_allocation_energy(self, carried_id, allocation):
+        self.state_of_charge_in_joules[0] = self.asset_info["capacity"] * self.asset_info["fillLevel"]
+        # An efficiency of 0 (not set in ESDL) means lossless, the self-discharge rate is a fraction per day
+        self.charge_efficiency = get_efficiency(self.asset_info.get("chargeEfficiency"))
+        self.discharge_efficiency = get_efficiency(self.asset_info.get("dischargeEfficiency"))
+        self.self_discharge_rate = self.asset_info.get("selfDischargeRate") or 0.0
+        self.retention_factor = 1.0
+        self.marginal_charge_costs = None
+        self.marginal_discharge_costs = None
+        self.resolve_marginal_costs()
+        # Optional look-ahead strategy that sets the price levels from the expected carrier costs
+        self.lookahead = LookaheadStrategy(self.asset_info["capacity"]) if mso_enable else None
+        for carrier_id in self.carriers_info:
+            self.add_carrier(carrier_id)
+
+    def add_carrier(self, carrier_id):
+        if self.keep_bid_curves:
+            self.bid_curves[carrier_id] = np.zeros((self.number_of_steps, MAX_BID_CURVE_POINTS, 2), dtype=np.float64)
+            self.bid_curve_points[carrier_id] = np.zeros(self.number_of_steps, dtype=np.int8)
+        self.bid_curve_energies[carrier_id] = np.full((self.number_of_steps, 2), np.nan, dtype=np.float64)
+        self.allocations_energy[carrier_id] = np.full(self.number_of_steps, np.nan, dtype=np.float64)
+
+    def ensure_number_of_steps(self, step_nr):
+        """ Grow the per step arrays if ESSIM sends more steps than expected from the simulation dates. """
+        if step_nr < self.number_of_steps:
+            return
+        number_of_steps = max(step_nr + 1, 2 * self.number_of_steps)
+        logger.warning(f"Step {step_nr} beyond the expected {self.number_of_steps} steps, growing to {number_of_steps}")
+        self.set_number_of_steps(number_of_steps)
+
+    def set_number_of_steps(self, number_of_steps):
+        """ Grow the per step arrays to number_of_steps, e.g. when the time step turns out to be smaller. """
+        if number_of_steps <= self.number_of_steps:
+            return
+
+        def grow(array, fill_value):
+            grown = np.full((number_of_steps + len(array) - self.number_of_steps, ) + array.shape[1:], fill_value,
+                            dtype=array.dtype)
+            grown[:len(array)] = array
+            return grown
+
+        self.state_of_charge_in_joules = grow(self.state_of_charge_in_joules, 0.0)
+        for carrier_id in self.allocations_energy:
+            if self.keep_bid_curves:
+                self.bid_curves[carrier_id] = grow(self.bid_curves[carrier_id], 0.0)
+                self.bid_curve_points[carrier_id] = grow(self.bid_curve_points[carrier_id], 0)
+            self.bid_curve_energies[carrier_id] = grow(self.bid_curve_energies[carrier_id], np.nan)
+            self.allocations_energy[carrier_id] = grow(self.allocations_energy[carrier_id], np.nan)
+        self.number_of_steps = number_of_steps
+        self.resolve_marginal_costs()
+
+    def store_bid_curve(self, carried_id, step_nr, bid_curve):
         if carried_id not in self.allocations_energy:
-            self.allocations_energy[carried_id] = list()
-
-        self.allocations_energy[carried_id].append(allocation)
-
-    def get_allocation_energy(self, carried_id, step_nr):
-        if carried_id in self.allocations_energy:
-            if step_nr >= len(self.allocations_energy[carried_id]):
-                print(
-                    f"Serious error: step_nr {step_nr}, len(self.allocations_energy[carried_id]) {len(self.allocations_energy[carried_id])}")
-            return self.allocations_energy[carried_id][step_nr]
-        return None
+            self.add_carrier(carried_id)
+        self.ensure_number_of_steps(step_nr)
+
+        self.current_bid_curves[carried_id] = (step_nr, bid_curve)
+        if self.keep_bid_curves:
+            self.bid_curves[carried_id][step_nr, :len(bid_curve)] = bid_curve
+            self.bid_curve_points[carried_id][step_nr] = len(bid_curve)
+        energies = self.bid_curve_energies[carried_id]
+        energies[step_nr, 0] = bid_curve[0][1]
+        energies[step_nr, 1] = bid_curve[-1][1]
+
+    def get_bid_curve(self, carried_id, step_nr):
+        if carried_id in self.current_bid_curves and self.current_bid_curves[carried_id][0] == step_nr:
+            return self.current_bid_curves[carried_id][1]
+        if self.keep_bid_curves and carried_id in self.bid_curves and step_nr < self.number_of_steps:
+            return self.bid_curves[carried_id][step_nr, :self.bid_curve_points[carried_id][step_nr]].tolist()
+        raise Exception(f"No bid curve stored for step {step_nr}")
+
+    def store_allocation_energy(self, carried_id, step_nr, allocation):
+        self.allocations_energy[carried_id][step_nr] = allocation
+
+    def get_step_allocation(self, step_nr):
+        """ Returns the sum of the allocations of the carriers that have been allocated in step step_nr. """
+        return sum(float(allocations[step_nr]) for allocations in self.allocations_energy.values()
+                   if not np.isnan(allocations[step_nr]))
+
+    def get_marginal_costs_per_step(self, attr):
+        """ Returns the marginal costs attr (marginalChargeCosts or marginalDischargeCosts) of every step.
+        Profiles are expected to be resolved into 'step_values', see ESSIMNode.resolve_marginal_costs. A profile
+        that is shorter than the simulation is extended with its last value.
+        """
+        profile_info = self.asset_info[attr]
+        if profile_info['type'] == 'SingleValue':
+            return np.full(self.number_of_steps, profile_info['value'], dtype=np.float64)
+        values = np.asarray(profile_info.get('step_values', []), dtype=np.float64)
+        if len(values) == 0:
+            raise Exception(f"No values for {attr} profile of type {profile_info['type']}")
+        costs = np.full(self.number_of_steps, values[-1], dtype=np.float64)
+        number_of_values = min(len(values), self.number_of_steps)
+        costs[:number_of_values] = values[:number_of_values]
+        missing_steps = np.flatnonzero(np.isnan(costs))
+        if len(missing_steps):
+            raise Exception(f"No value for {attr} in step {missing_steps[0]}, the {profile_info['type']} does not "
+                            f"cover {len(missing_steps)} steps of the simulation")
+        return costs
+
+    def resolve_marginal_costs(self):
+        """ Resolve the marginal costs into one value per step and check them for the whole simulation. """
+        self.marginal_charge_costs = self.get_marginal_costs_per_step("marginalChargeCosts")
+        self.marginal_discharge_costs = self.get_marginal_costs_per_step("marginalDischargeCosts")
+        invalid_steps = np.flatnonzero(self.marginal_charge_costs > self.marginal_discharge_costs)
+        if len(invalid_steps):
+            step_nr = invalid_steps[0]
+            raise Exception(f"step_nr {step_nr}: Marginal charge costs ({self.marginal_charge_costs[step_nr]}) > "
+                            f"Marginal discharge costs ({self.marginal_discharge_costs[step_nr]})"
+                            f"{f' and {len(invalid_steps) - 1} more steps' if len(invalid_steps) > 1 else ''}")
 
     def get_marginal_charge_costs(self, step_nr):
-        if self.asset_info['marginalChargeCosts']['type'] == 'SingleValue':
-            return self.asset_info['marginalChargeCosts']['value']
-        else:
-            raise Exception('Other marginal cost types than SingleValue have not been implemented yet!')
+        return float(self.marginal_charge_costs[step_nr])
 
     def get_marginal_discharge_costs(self, step_nr):
-        if self.asset_info['marginalDischargeCosts']['type'] == 'SingleValue':
-            return self.asset_info['marginalDischargeCosts']['value']
-        else:
-            raise Exception('Other marginal cost types than SingleValue have not been implemented yet!')
+        return float(self.marginal_discharge_costs[step_nr])
 
     def create_bid_curve(self, step_nr, timestamp, duration, minprice, maxprice, carrier_id):
         self.min_price = minprice
         self.max_price = maxprice
+        if duration != self.duration:
+            self.retention_factor = get_retention_factor(self.self_discharge_rate, duration)
         self.duration = duration
 
-        current_soc = self.state_of_charge_in_joules[step_nr]
+        self.ensure_number_of_steps(step_nr)
+        current_soc = float(self.state_of_charge_in_joules[step_nr])
         charge_fill_fraction = current_soc / self.asset_info['capacity']
+        # The energy that is left at the end of this step without charging or discharging
+        retained_soc = current_soc * self.retention_factor
 
-        hour_of_day = datetime.fromtimestamp(timestamp).hour
-
-        allow_charge = True
-        if self.charge_time_windows and charge_fill_fraction > float(self.charge_time_windows[
-                                                                         'always_charge_below_fill_fraction']):
-            allow_charge = False
-            for window in self.charge_time_windows['windows']:
-                if not allow_charge:
-                    allow_charge = int(window["start_hour"]) <= hour_of_day < int(window["end_hour"])
-
-        allow_discharge = True
-        if self.discharge_time_windows and charge_fill_fraction < float(self.discharge_time_windows[
-                                                                            'always_discharge_above_fill_fraction']):
-            allow_discharge = False
-            for window in self.discharge_time_windows['windows']:
-                if not allow_discharge:
-                    allow_discharge = int(window["start_hour"]) <= hour_of_day < int(window["end_hour"])
-
-        logger.debug(f"hour_of_day '{hour_of_day}': allow_charge {allow_charge} allow_discharge {allow_discharge}")
+        hour_of_day = get_hour_of_day(timestamp)
+        allow_charge = not charge_fill_fraction > self.charge_threshold or bool(self.charge_hours[hour_of_day])
+        allow_discharge = not charge_fill_fraction < self.discharge_threshold or \
+            bool(self.discharge_hours[hour_of_day])
 
         if allow_charge:
             max_charge_this_timestep = min(
                 self.asset_info['maxChargeRate'] * duration,  # max joules that can be added in this timestep
-                self.asset_info['capacity'] - current_soc  # "Space" left in Joules
+                # "Space" left in Joules, taking the charge losses into account
+                (self.asset_info['capacity'] - retained_soc) / self.charge_efficiency
             )
         else:
             max_charge_this_timestep = 0
@@ -116,15 +225,16 @@ class BatteryNode:
         if allow_discharge:
             max_discharge_this_timestep = min(
                 self.asset_info['maxDischargeRate'] * duration,  # max Joules that can be used in this timestep
-                current_soc  # Charge available in Joules
+                retained_soc * self.discharge_efficiency  # Charge available in Joules, after discharge losses
             )
         else:
             max_discharge_this_timestep = 0
 
         mcc = self.get_marginal_charge_costs(step_nr)
         mdc = self.get_marginal_discharge_costs(step_nr)
-        if mcc > mdc:
-            raise Exception(f"step_nr {step_nr}: Marginal charge costs ({mcc}) > Marginal discharge costs ({mdc})")
+        if self.lookahead is not None:
+            mcc, mdc = self.get_lookahead_price_levels(step_nr, carrier_id, current_soc, duration, minprice, maxprice,
+                                                       mcc, mdc)
 
         # e is the amount of energy in Joules that can be consumed in one timestep
         # e = power * duration
@@ -159,8 +269,10 @@ class BatteryNode:
             bid_curve[1][1] = -self.delta   # is both are 0 (or very small), change the latter to -delta to keep strictly decreasing
 
         # Bidcurve is needed when allocation is received. For now, save all created bidcurves
-        logger.info(f"Time step={step_nr}: bidcurve {bid_curve}")
-        self.store_bid_curve(carrier_id, bid_curve)
+        if is_trace_step(logger, step_nr):
+            logger.debug("Time step=%s: hour_of_day %s, allow_charge %s, allow_discharge %s, bidcurve %s",
+                         step_nr, hour_of_day, allow_charge, allow_discharge, bid_curve)
+        self.store_bid_curve(carrier_id, step_nr, bid_curve)
         return bid_curve
 
     def get_carrier_cost(self, carrier_type, step_nr):
@@ -172,11 +284,34 @@ class BatteryNode:
                     return carr['carrier_cost']
         return 0
 
+    def get_expected_prices(self, carrier_id, step_nr, number_of_steps):
+        """ Returns the carrier costs of the number_of_steps steps from step_nr, fewer at the end of the profile or
+        before a step without a cost (NaN, outside the profile).
+        """
+        carrier_cost = self.carriers_info[carrier_id].get("carrier_cost")
+        if carrier_cost is None:
+            return np.empty(0)
+        if np.ndim(carrier_cost) == 0:
+            return np.full(number_of_steps, carrier_cost, dtype=np.float64)
+        prices = np.asarray(carrier_cost[step_nr:step_nr + number_of_steps], dtype=np.float64)
+        missing = np.flatnonzero(np.isnan(prices))
+        return prices[:missing[0]] if len(missing) else prices
+
+    def get_lookahead_price_levels(self, step_nr, carrier_id, current_soc, duration, minprice, maxprice, mcc, mdc):
+        expected_prices = self.get_expected_prices(carrier_id, step_nr + 1, self.lookahead.horizon)
+        charge_level, discharge_level = self.lookahead.get_price_levels(
+            current_soc, expected_prices, mcc, mdc,
+            self.asset_info['maxChargeRate'] * duration, self.asset_info['maxDischargeRate'] * duration)
+        # Keep the price levels inside the price range, so the prices of the bid curve stay increasing
+        lower = minprice + 2 * self.delta
+        upper = maxprice - 2 * self.delta
+        if lower <= upper:
+            charge_level = min(max(charge_level, lower), upper)
+            discharge_level = min(max(discharge_level, lower), upper)
+        return charge_level, discharge_level
+
     def process_allocation(self, step_nr, price, carrier_id):
-        logger.debug(f"process_allocation - step_nr: {step_nr}, price: {price} for carrier: "
-                     f"{self.carriers_info[carrier_id]['carrier_type']}")
-        current_bid_curve = self.bid_curves[carrier_id][step_nr]
-        logger.debug(current_bid_curve)
+        current_bid_curve = self.get_bid_curve(carrier_id, step_nr)
         allocation = None
         if price < self.min_price + 1e-12:
             allocation = current_bid_curve[0][1]
@@ -191,56 +326,201 @@ class BatteryNode:
         if allocation is None:
             raise Exception("No allocation found - serious error!")
 
+        self.store_allocation_energy(carrier_id, step_nr, allocation)
+        # The state of charge changes with the sum of the allocations of all carriers in the step (the same rule as
+        # replay_state_of_charge), every next allocation of the step recomputes it from the start of the step
         # Allocation > 0: charge, so SoC increases
         # Allocation < 0: discharge, so SoC decreases
-        new_soc = self.state_of_charge_in_joules[step_nr] + allocation
-        if new_soc < 0:
-            new_soc = 0
-        self.state_of_charge_in_joules.append(new_soc)
-
-        logger.debug(
-            f"Allocation/duration ({self.carriers_info[carrier_id]['carrier_type']}): {allocation / self.duration}")
-
-        logger.info(f"Time step={step_nr}: allocation {allocation}, new_soc {new_soc}")
-        self.store_allocation_energy(carrier_id, allocation)
+        new_soc = get_next_state_of_charge(float(self.state_of_charge_in_joules[step_nr]),
+                                           self.get_step_allocation(step_nr), self.asset_info['capacity'],
+                                           self.charge_efficiency, self.discharge_efficiency, self.retention_factor)
+        self.state_of_charge_in_joules[step_nr + 1] = new_soc
+
+        if is_trace_step(logger, step_nr):
+            logger.debug("Time step=%s: price %s, bidcurve %s, allocation %s (%s J/s, %s), new_soc %s", step_nr,
+                         price, current_bid_curve, allocation, allocation / self.duration,
+                         self.carriers_info[carrier_id]['carrier_type'], new_soc)
+
+        if self.result_writer is not None:
+            self.stream_result(step_nr)
         return allocation
 
-    def write_results(self, influxdb_client, simulation_run_id, start_timestamp):
-        points = list()
-        first_timestamp = None
-
-        t_rms = 0.0
-        for i in range(self.simulation_info['number_of_steps'] - 1):
-            try:
-                time = datetime.utcfromtimestamp(start_timestamp + i * self.duration).strftime("%Y-%m-%dT%H:%M:%SZ")
-                if first_timestamp is None:
-                    first_timestamp = time
-
-                fields = {
-                    "State_of_charge_in_joules": float(self.state_of_charge_in_joules[i]),
-                    "State_of_charge_in_fraction": float(
-                        self.state_of_charge_in_joules[i] / self.asset_info["capacity"]),
-                }
-
-                for carr in self.carriers_info:
-                    carr_type = self.carriers_info[carr]["carrier_type"].replace("Commodity", "")
-                    fields[carr_type + "_allocation_energy"] = float(self.get_allocation_energy(carr, i))
-                    fields[carr_type + "_bid_curve_energy_start"] = float(self.bid_curves[carr][i][0][1])
-                    fields[carr_type + "_bid_curve_energy_end"] = float(self.bid_curves[carr][i][-1][1])
-                    if "carrier_cost" in self.carriers_info[carr]:
-                        fields[carr_type + "_cost"] = float(self.carriers_info[carr]["carrier_cost"][i])
-
-                item = {
-                    "measurement": f"battery-{self.asset_info['name']}",
-                    "tags": {"simulationRun": simulation_run_id},
-                    "time": time,
-                    "fields": fields,
-                }
-            except Exception as e:
-                logger.debug(f"Exception: {e.message} {e.args}")
-                continue
-            points.append(item)
-
-        logger.info(
-            f"InfluxDB writing {len(points)} points to measurement 'battery-{self.asset_info['name']}' with tag simulationRun {simulation_run_id}")
-        influxdb_client.write(points)
+    def replay_state_of_charge(self, allocations=None):
+        """ Recompute the state of charge of every step from the allocations in one pass, e.g. to check or post-process
+        the results without repeating the simulation.
+        :param allocations: The allocated energy of every step, by default the sum of the allocations of all carriers
+                            of the steps that have been allocated.
+        :return: The state of charge at the start of every step and at the end of the last step.
+        """
+        if allocations is None:
+            allocated = np.column_stack(list(self.allocations_energy.values()))
+            # Up to the first step that has not been allocated
+            unallocated = np.flatnonzero(~np.isfinite(allocated).all(axis=1))
+            number_of_steps = unallocated[0] if len(unallocated) else len(allocated)
+            allocations = allocated[:number_of_steps].sum(axis=1)
+        retention_factor = get_retention_factor(self.self_discharge_rate, self.simulation_info['stepsize_in_seconds'])
+        return replay_state_of_charge(self.asset_info["capacity"] * self.asset_info["fillLevel"], allocations,
+                                      self.asset_info["capacity"], self.charge_efficiency, self.discharge_efficiency,
+                                      retention_factor)
+
+    def get_snapshot(self, number_of_steps):
+        """ Returns the state after the first number_of_steps steps, as metadata and arrays for save_snapshot. """
+        carrier_ids = list(self.allocations_energy.keys())
+        metadata = {
+            "number_of_steps": number_of_steps,
+            "carrier_ids": carrier_ids,
+            "duration": self.duration,
+            "min_price": self.min_price,
+            "max_price": self.max_price,
+        }
+        arrays = {"state_of_charge_in_joules": self.state_of_charge_in_joules[:number_of_steps + 1]}
+        for i, carrier_id in enumerate(carrier_ids):
+            arrays[f"allocations_energy_{i}"] = self.allocations_energy[carrier_id][:number_of_steps]
+            arrays[f"bid_curve_energies_{i}"] = self.bid_curve_energies[carrier_id][:number_of_steps]
+            if self.keep_bid_curves:
+                arrays[f"bid_curves_{i}"] = self.bid_curves[carrier_id][:number_of_steps]
+                arrays[f"bid_curve_points_{i}"] = self.bid_curve_points[carrier_id][:number_of_steps]
+        return metadata, arrays
+
+    def restore_snapshot(self, metadata, arrays):
+        """ Restore the state of the steps in a snapshot of get_snapshot. The state of charge of the later steps is
+        set to the last one in the snapshot, the steps between the snapshot and a restart are not known.
+        """
+        number_of_steps = metadata["number_of_steps"]
+        self.ensure_number_of_steps(number_of_steps - 1)
+        self.state_of_charge_in_joules[:number_of_steps + 1] = arrays["state_of_charge_in_joules"]
+        self.state_of_charge_in_joules[number_of_steps + 1:] = self.state_of_charge_in_joules[number_of_steps]
+        for i, carrier_id in enumerate(metadata["carrier_ids"]):
+            if carrier_id not in self.allocations_energy:
+                self.add_carrier(carrier_id)
+            self.allocations_energy[carrier_id][:number_of_steps] = arrays[f"allocations_energy_{i}"]
+            self.bid_curve_energies[carrier_id][:number_of_steps] = arrays[f"bid_curve_energies_{i}"]
+            if self.keep_bid_curves and f"bid_curves_{i}" in arrays:
+                self.bid_curves[carrier_id][:number_of_steps] = arrays[f"bid_curves_{i}"]
+                self.bid_curve_points[carrier_id][:number_of_steps] = arrays[f"bid_curve_points_{i}"]
+        self.min_price = metadata["min_price"]
+        self.max_price = metadata["max_price"]
+        if metadata["duration"]:
+            self.duration = metadata["duration"]
+            self.retention_factor = get_retention_factor(self.self_discharge_rate, self.duration)
+
+    def is_step_allocated(self, step_nr):
+        if step_nr >= self.number_of_steps:
+            return False
+        for carr in self.carriers_info:
+            if carr not in self.allocations_energy or np.isnan(self.allocations_energy[carr][step_nr]):
+                return False
+        return True
+
+    def start_result_stream(self, result_writer, simulation_run_id, start_timestamp):
+        """ Write the results of every step to result_writer as soon as all its allocations are processed. """
+        self.result_writer = result_writer
+        self.simulation_run_id = simulation_run_id
+        self.start_timestamp = start_timestamp
+        self.line_encoder = LineProtocolEncoder(f"battery-{self.asset_info['name']}",
+                                                {"simulationRun": simulation_run_id}, self.get_result_columns(0).keys())
+
+    def stream_result(self, step_nr):
+        """ Add the results of step step_nr to the result writer, if all its allocations are processed. """
+        if self.is_step_allocated(step_nr):
+            line = self.create_result_line(step_nr)
+            if line is not None:
+                self.result_writer.add(line)
+
+    def get_carrier_cost_column(self, carrier_id, number_of_steps):
+        carrier_cost = self.carriers_info[carrier_id]["carrier_cost"]
+        if np.ndim(carrier_cost) == 0:
+            return np.full(number_of_steps, carrier_cost, dtype=np.float64)
+        column = np.full(number_of_steps, np.nan, dtype=np.float64)
+        values = np.asarray(carrier_cost[:number_of_steps], dtype=np.float64)
+        column[:len(values)] = values
+        return column
+
+    def get_result_columns(self, number_of_steps):
+        """ Returns the result fields of the first number_of_steps steps as a dict of arrays, one per field. """
+        state_of_charge = self.state_of_charge_in_joules[:number_of_steps]
+        columns = {
+            "State_of_charge_in_joules": state_of_charge,
+            "State_of_charge_in_fraction": state_of_charge / self.asset_info["capacity"],
+        }
+
+        for carr in self.carriers_info:
+            carr_type = self.carriers_info[carr]["carrier_type"].replace("Commodity", "")
+            columns[carr_type + "_allocation_energy"] = self.allocations_energy[carr][:number_of_steps]
+            columns[carr_type + "_bid_curve_energy_start"] = self.bid_curve_energies[carr][:number_of_steps, 0]
+            columns[carr_type + "_bid_curve_energy_end"] = self.bid_curve_energies[carr][:number_of_steps, 1]
+            if "carrier_cost" in self.carriers_info[carr]:
+                columns[carr_type + "_cost"] = self.get_carrier_cost_column(carr, number_of_steps)
+        return columns
+
+    def get_result_row(self, i):
+        """ Returns the result fields of step i, in the order of get_result_columns. Like there, the carrier cost is NaN
+        for steps after the end of its profile.
+        """
+        state_of_charge = float(self.state_of_charge_in_joules[i])
+        row = [state_of_charge, state_of_charge / self.asset_info["capacity"]]
+        for carr, carrier_info in self.carriers_info.items():
+            energies = self.bid_curve_energies[carr]
+            row += [float(self.allocations_energy[carr][i]), float(energies[i, 0]), float(energies[i, 1])]
+            if "carrier_cost" in carrier_info:
+                carrier_cost = carrier_info["carrier_cost"]
+                if np.ndim(carrier_cost) == 0:
+                    row.append(float(carrier_cost))
+                else:
+                    row.append(float(carrier_cost[i]) if i < len(carrier_cost) else np.nan)
+        return row
+
+    def create_result_line(self, i):
+        """ Returns the results of step i as a line protocol line (see start_result_stream), or None if a field has no
+        finite value. Such steps are not written, as in write_results.
+        """
+        return self.line_encoder.encode(int(self.start_timestamp + i * self.simulation_info['stepsize_in_seconds']),
+                                        self.get_result_row(i))
+
+    def get_bid_curve_columns(self, number_of_steps):
+        """ Returns the bid curves of the first number_of_steps steps per carrier type, as (steps, points, 2) arrays of
+        (price, energy) points padded with NaN. Empty if the bid curves are not kept.
+        """
+        bid_curves = dict()
+        if not self.keep_bid_curves:
+            return bid_curves
+        for carr in self.carriers_info:
+            carr_type = self.carriers_info[carr]["carrier_type"].replace("Commodity", "")
+            curves = self.bid_curves[carr][:number_of_steps].copy()
+            unused = np.arange(MAX_BID_CURVE_POINTS) >= self.bid_curve_points[carr][:number_of_steps, np.newaxis]
+            curves[unused] = np.nan
+            bid_curves[carr_type] = curves
+        return bid_curves
+
+    def write_results(self, result_sink, simulation_run_id, start_timestamp):
+        """ Write the results of all allocated steps to result_sink (see result_sinks), unless they have been
+        streamed to the result writer already.
+        """
+        if self.result_writer is not None:
+            # Results were streamed during the simulation, only the remaining points need to be written
+            result_writer = self.result_writer
+            self.result_writer = None
+            result_writer.close()
+            logger.info(
+                f"InfluxDB wrote {result_writer.points_written} points to measurement "
+                f"'battery-{self.asset_info['name']}' with tag simulationRun {self.simulation_run_id}")
+            return
+        if result_sink is None:
+            logger.warning(f"No result sink configured, the results of '{self.asset_info['name']}' are not written")
+            return
+
+        self.simulation_run_id = simulation_run_id
+        self.start_timestamp = start_timestamp
+        number_of_steps = min(self.simulation_info['number_of_steps'] - 1, self.number_of_steps)
+        columns = self.get_result_columns(number_of_steps)
+        values = np.column_stack(list(columns.values()))
+        # Only steps with a value for every field (i.e. that have been allocated) are written
+        complete_steps = np.flatnonzero(np.isfinite(values).all(axis=1))
+        timestamps = start_timestamp + complete_steps * int(self.simulation_info['stepsize_in_seconds'])
+        bid_curves = {carr_type: curves[complete_steps]
+                      for carr_type, curves in self.get_bid_curve_columns(number_of_steps).items()}
+        try:
+            result_sink.write(f"battery-{self.asset_info['name']}", simulation_run_id, timestamps,
+                              {field: column[complete_steps] for field, column in columns.items()}, bid_curves)
+        finally:
+            result_sink.close()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#  This work is based on original code developed and copyrighted by TNO 2025.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+import numpy as np
+from scipy.signal import lfilter
+
+SECONDS_PER_DAY = 86400
+
+
+def get_efficiency(efficiency):
+    """ Returns the efficiency as a fraction. ESDL uses 0 when the efficiency is not set, which means lossless. """
+    if not efficiency:
+        return 1.0
+    return float(efficiency)
+
+
+def get_retention_factor(self_discharge_rate, duration):
+    """ Returns the fraction of the stored energy that is left after duration seconds.
+    :param self_discharge_rate: The fraction of the stored energy that is lost per day.
+    :param duration: The duration in seconds.
+    """
+    if not self_discharge_rate:
+        return 1.0
+    return (1.0 - float(self_discharge_rate)) ** (duration / SECONDS_PER_DAY)
+
+
+def get_stored_energy(allocation, charge_efficiency, discharge_efficiency):
+    """ Returns the change of the stored energy for an allocation.
+    An allocation > 0 charges the battery, of which a charge_efficiency fraction is stored. An allocation < 0
+    discharges the battery, for which 1 / discharge_efficiency times as much energy is taken from storage.
+    """
+    if allocation > 0:
+        return allocation * charge_efficiency
+    return allocation / discharge_efficiency
+
+
+def get_next_state_of_charge(state_of_charge, allocation, capacity, charge_efficiency=1.0, discharge_efficiency=1.0,
+                             retention_factor=1.0):
+    """ Returns the state of charge after a step with the given allocation, limited to [0, capacity]. """
+    new_soc = state_of_charge * retention_factor + get_stored_energy(allocation, charge_efficiency,
+                                                                     discharge_efficiency)
+    if new_soc < 0:
+        return 0.0
+    if new_soc > capacity:
+        return capacity
+    return new_soc
+
+
+def replay_state_of_charge(initial_state_of_charge, allocations, capacity, charge_efficiency=1.0,
+                           discharge_efficiency=1.0, retention_factor=1.0):
+    """ Recompute the state of charge trajectory for a sequence of allocations.
+
+    The trajectory without limits is a first order linear recurrence, computed in one pass with a cumulative sum
+    (or lfilter with self-discharge). Only if it leaves [0, capacity] the steps are replayed one by one, from the
+    first step where it does.
+    :param initial_state_of_charge: The state of charge at the start of the first step in Joules.
+    :param allocations: The allocated energy of every step in Joules.
+    :return: An array with the state of charge at the start of every step and at the end of the last step.
+    """
+    allocations = np.asarray(allocations, dtype=np.float64)
+    stored = np.where(allocations > 0, allocations * charge_efficiency, allocations / discharge_efficiency)
+
+    soc = np.empty(len(allocations) + 1, dtype=np.float64)
+    soc[0] = initial_state_of_charge
+    if retention_factor == 1.0:
+        soc[1:] = initial_state_of_charge + np.cumsum(stored)
+    else:
+        soc[1:], _ = lfilter([1.0], [1.0, -retention_factor], stored, zi=[initial_state_of_charge * retention_factor])
+
+    outside = np.flatnonzero((soc[1:] < 0) | (soc[1:] > capacity))
+    if len(outside):
+        # The limits make the recurrence non-linear, fall back to stepping from the first step that hits one
+        values = stored.tolist()
+        state_of_charge = float(soc[outside[0]])
+        for i in range(outside[0], len(values)):
+            state_of_charge = min(max(state_of_charge * retention_factor + values[i], 0.0), capacity)
+            soc[i + 1] = state_of_charge
+    return soc
@@ -13,16 +13,23 @@
 #  Manager:
 #      TNO
 
+import hashlib
 import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 from esdl import esdl, EnergyAsset, CostInformation, SingleValue
 from esdl.esdl_handler import EnergySystemHandler
 from influxdb import InfluxDBClient
 
+from tno.essim_battery.influxdb_profile_reader import align_to_start, get_grid_start, read_influxdb_profile, to_epoch
+from tno.essim_battery.profile_cache import get_profile_cache
 from tno.shared.log import get_logger
 
 logger = get_logger(__name__)
+profile_cache = get_profile_cache()
 influx_cred = os.getenv('INFLUXDB_CREDENTIALS')
 influx_cred_map = {}
 if influx_cred is not None:
@@ -47,15 +54,33 @@ if influx_cred is not None:
             influx_cred_map[influx_host] = (username, password)
     logger.debug('Processed {} InfluxDB credentials'.format(len(influx_cred_map)))
 
+# The maximum number of InfluxDB profile queries that run at the same time when prefetching a config
+PROFILE_FETCH_WORKERS = int(os.getenv('PROFILE_FETCH_WORKERS', '8'))
+# The profile info that determines the query result, the multiplier is not applied to the queried values
+PROFILE_QUERY_FIELDS = ['host', 'port', 'database', 'measurement', 'field', 'startDate', 'endDate']
+
 
 class ESDLProcessor:
 
     def __init__(self):
         self.esh = EnergySystemHandler()
         self.energy_system: esdl.EnergySystem = None
+        self.esdl_hash = None
+        # InfluxDB profiles fetched by the last call of prefetch_profiles, by query key
+        self.prefetched_profiles = dict()
 
     def load_string(self, esdl_string):
+        # All nodes hosted by one client receive the same ESDL, only parse it when it changes
+        esdl_hash = hashlib.sha256(esdl_string.encode("utf-8")).hexdigest()
+        if esdl_hash == self.esdl_hash:
+            logger.debug("ESDL unchanged, reusing parsed energy system")
+            return
         self.energy_system = self.esh.load_from_string(esdl_string)
+        self.esdl_hash = esdl_hash
+        self.prefetched_profiles = dict()
+
+    def get_battery_ids(self):
+        return [asset.id for asset in self.esh.get_all_instances_of_type(esdl.Battery)]
 
     def find_control_strategy(self, asset):
         services = self.energy_system.services
@@ -100,7 +125,11 @@ class ESDLProcessor:
 
         return asset_info
 
-    def get_carriers_for_asset(self, asset_id):
+    def get_carriers_for_asset(self, asset_id, time_step, start_timestamp):
+        """ Returns the carrier information of all ports of an asset.
+        :param time_step: The time step in seconds InfluxDB profiles are resampled to.
+        :param start_timestamp: The start of the simulation (epoch seconds), InfluxDB profiles start at this step.
+        """
         asset = self.esh.get_by_id(asset_id)
         carrier_dict = dict()
         carrier_cost = {}
@@ -110,7 +139,8 @@ class ESDLProcessor:
                 carrier_cost = {}
                 if carrier.cost:
                     if isinstance(carrier.cost, esdl.InfluxDBProfile):
-                        carrier_cost = {'carrier_cost': self.get_influxdb_profile(self.get_profile_info(carrier.cost))}
+                        carrier_cost = {'carrier_cost': self.get_profile_values(self.get_profile_info(carrier.cost),
+                                                                                  time_step, start_timestamp)}
                     elif isinstance(carrier.cost, esdl.SingleValue):
                         carrier_cost = {'carrier_cost': carrier.cost.value}
                     else:
@@ -121,7 +151,8 @@ class ESDLProcessor:
                     profile = port.profile[0]
                     if isinstance(profile, esdl.InfluxDBProfile):
                         profile_info = {
-                            'values': self.get_influxdb_profile(self.get_profile_info(profile)),
+                            'values': self.get_profile_values(self.get_profile_info(profile), time_step,
+                                                              start_timestamp),
                             'unit': 'JOULE'
                         }
                         if profile.profileQuantityAndUnit:
@@ -137,8 +168,93 @@ class ESDLProcessor:
                 }
         return carrier_dict
 
+    def get_influxdb_profile_infos(self, asset_id):
+        """ Returns the profile info of every InfluxDB profile an asset uses: carrier costs, port profiles and
+        marginal costs.
+        """
+        try:
+            asset = self.esh.get_by_id(asset_id)
+        except KeyError:
+            # A hosted node that is not in this energy system
+            return []
+        profiles = []
+        if asset:
+            for port in asset.port:
+                profiles.append(port.carrier.cost)
+                if port.profile:
+                    profiles.append(port.profile[0])
+            cs = self.find_control_strategy(asset)
+            if isinstance(cs, esdl.StorageStrategy):
+                profiles.extend([cs.marginalChargeCosts, cs.marginalDischargeCosts])
+        return [self.get_profile_info(p) for p in profiles if isinstance(p, esdl.InfluxDBProfile)]
+
     @staticmethod
-    def get_influxdb_profile(profile_info):
+    def get_influxdb_profile_key(profile_info, time_step, start_timestamp):
+        return (time_step, start_timestamp) + tuple(str(profile_info.get(k)) for k in PROFILE_QUERY_FIELDS)
+
+    def prefetch_profiles(self, asset_ids, time_step, start_timestamp, max_workers=PROFILE_FETCH_WORKERS):
+        """ Query the InfluxDB profiles of all given assets at once, instead of one after the other when every node
+        handles its config. Identical queries (e.g. a carrier cost shared by all batteries) are run only once.
+        Failed queries are logged and run again when the profile is used. The profiles of an earlier call are
+        dropped, profiles are only kept across simulations by the profile cache.
+        :param asset_ids: The ids of the assets in the loaded energy system.
+        :param time_step: The time step the profiles are resampled to in InfluxDB, see get_influxdb_profile.
+        :param start_timestamp: The start of the simulation in epoch seconds.
+        :param max_workers: The maximum number of queries that run at the same time.
+        """
+        self.prefetched_profiles = dict()
+        queries = dict()
+        for asset_id in asset_ids:
+            for profile_info in self.get_influxdb_profile_infos(asset_id):
+                queries.setdefault(self.get_influxdb_profile_key(profile_info, time_step, start_timestamp),
+                                   profile_info)
+        if not queries:
+            return
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(queries)),
+                                thread_name_prefix="ProfileFetch") as executor:
+            futures = {key: executor.submit(self.get_influxdb_profile, profile_info, time_step, start_timestamp)
+                       for key, profile_info in queries.items()}
+            for key, future in futures.items():
+                try:
+                    self.prefetched_profiles[key] = future.result()
+                except Exception as e:
+                    logger.warning(f"Prefetching profile {queries[key]['field']} failed: {e}")
+        logger.info(f"Prefetched {len(queries)} profiles for {len(asset_ids)} assets in "
+                    f"{time.perf_counter() - start:.2f}s")
+
+    def get_profile_values(self, profile_info, time_step, start_timestamp):
+        """ Returns the values of an InfluxDB profile, prefetched or else queried now. """
+        data_points = self.prefetched_profiles.get(
+            self.get_influxdb_profile_key(profile_info, time_step, start_timestamp))
+        if data_points is None:
+            data_points = self.get_influxdb_profile(profile_info, time_step, start_timestamp)
+        return data_points
+
+    @staticmethod
+    def get_influxdb_profile(profile_info, time_step, start_timestamp):
+        """ Query an InfluxDB profile, averaged (or forward filled) in InfluxDB to time_step seconds.
+        The profile is read in chunks of PROFILE_CHUNK_SECONDS, see read_influxdb_profile.
+        :param start_timestamp: The start of the simulation in epoch seconds. The InfluxDB groups are aligned to the
+                                simulation time steps, and the values start at the first step of the simulation: steps
+                                before the start of the profile are NaN.
+        """
+        if profile_info['startDate'] is None:
+            raise ValueError(f'Start date missing in profile {profile_info}')
+        if profile_info['endDate'] is None:
+            raise ValueError(f'End date missing in profile {profile_info}')
+        grid_start = get_grid_start(to_epoch(profile_info['startDate']), time_step, start_timestamp)
+
+        cache_key = None
+        if profile_cache is not None:
+            cache_key = profile_cache.make_key(time_step=time_step, offset=start_timestamp % time_step,
+                                               **{k: profile_info.get(k) for k in PROFILE_QUERY_FIELDS})
+            data_points = profile_cache.get(cache_key)
+            if data_points is not None:
+                logger.info(f"Profile cache hit for {profile_info['field']} ({len(data_points)} data_points)")
+                return align_to_start(data_points, grid_start, start_timestamp, time_step)
+
         profile_host = profile_info['host']
         influx_host = '{}:{}'.format(profile_host, profile_info['port'])
         if influx_host in influx_cred_map:
@@ -154,28 +270,21 @@ class ESDLProcessor:
             profile_host = profile_host[7:]
         if profile_info['port'] == 443:
             ssl_setting = True
-        if profile_info['startDate'] is not None:
-            profile_start_date = str(profile_info['startDate'].isoformat()).replace('T', ' ')
-        else:
-            raise ValueError(f'Start date missing in profile {profile_info}')
-        if profile_info['endDate'] is not None:
-            end_date_suffix = " AND time <= '{}'".format(str(profile_info['endDate'].isoformat()).replace('T', ' '))
-        else:
-            raise ValueError(f'End date missing in profile {profile_info}')
-        query = 'SELECT ("{}") FROM "{}" WHERE time >= \'{}\'{}'.format(
-            profile_info['field'],
-            profile_info['measurement'],
-            profile_start_date,
-            end_date_suffix)
 
         client = InfluxDBClient(host=profile_host, port=profile_info['port'], username=username,
                                 password=password, ssl=ssl_setting, verify_ssl=ssl_setting)
         client.switch_database(profile_info['database'])
-        data = client.query(query=query)
-        data_points = [t[1] for t in data.raw["series"][0]["values"]]
+        try:
+            data_points, _ = read_influxdb_profile(client, profile_info['measurement'], profile_info['field'],
+                                                   profile_info['startDate'], profile_info['endDate'], time_step,
+                                                   fill='previous', origin=start_timestamp)
+        finally:
+            client.close()
 
         logger.info(f"First 10/{len(data_points)} influxdb data_points for {profile_info['field']}: {', '.join([str(p) for p in data_points[:10]])}")
-        return data_points
+        if cache_key is not None:
+            data_points = profile_cache.put(cache_key, data_points)
+        return align_to_start(data_points, grid_start, start_timestamp, time_step)
 
         #
         # influxdb_client = InfluxDBConnector(profile_info["host"], profile_info["port"], profile_info["database"])
@@ -189,6 +298,43 @@ class ESDLProcessor:
         # profile = list(map(lambda x: x[profile_info["field"]], results))
         # return profile
 
+    @staticmethod
+    def resample_profile(values, from_time_step, to_time_step):
+        """ Resample a profile with one value per from_time_step seconds to one value per to_time_step seconds.
+        Upsampling repeats values, downsampling averages them.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if from_time_step == to_time_step or len(values) == 0:
+            return values
+        if to_time_step < from_time_step:
+            if from_time_step % to_time_step == 0:
+                return np.repeat(values, from_time_step // to_time_step)
+            number_of_values = int(len(values) * from_time_step // to_time_step)
+            return values[np.arange(number_of_values) * to_time_step // from_time_step]
+        else:
+            # Average the values that start in every new time step
+            starts = np.arange(0, len(values) * from_time_step, to_time_step) // from_time_step
+            sums = np.add.reduceat(values, starts)
+            counts = np.diff(np.append(starts, len(values)))
+            return sums / counts
+
+    @staticmethod
+    def align_time_series(values, from_time_step, profile_start, to_time_step, start_timestamp):
+        """ Resample a profile with one value per from_time_step seconds from profile_start (epoch seconds) to one
+        value per to_time_step seconds from the start of the simulation. Steps before the start of the profile are NaN,
+        values before the start of the simulation are dropped.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        offset = profile_start - start_timestamp
+        if offset % from_time_step == 0:
+            return ESDLProcessor.resample_profile(align_to_start(values, profile_start, start_timestamp,
+                                                                 from_time_step), from_time_step, to_time_step)
+        if offset % to_time_step != 0:
+            logger.warning(f"Profile start {profile_start} is not on a {to_time_step}s time step of the simulation, "
+                           f"it is moved to the start of that time step")
+        return align_to_start(ESDLProcessor.resample_profile(values, from_time_step, to_time_step),
+                              start_timestamp + offset // to_time_step * to_time_step, start_timestamp, to_time_step)
+
     def get_profile_info(self, profile):
         profile_info = dict()
         if isinstance(profile, esdl.SingleValue):
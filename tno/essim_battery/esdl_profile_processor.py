@@ -14,21 +14,32 @@
 #      TNO
 
 import hashlib
+import json
 import os
 import re
 from typing import Union
 
-import log4p
 import numpy as np
 import pandas as pd
 from esdl import esdl, Port, ProfileReference
 from influxdb import InfluxDBClient
 
-logger = log4p.GetLogger(__name__, config='log4p.json')
-log = logger.logger
+from tno.essim_battery.influxdb_profile_reader import read_influxdb_profile
+from tno.essim_battery.profile_cache import DataFrameCache
+from tno.shared.log import get_logger
+
+log = get_logger(__name__)
 influx_cred = os.getenv('INFLUXDB_CREDENTIALS')
 
 
+def to_epoch_seconds(dates):
+    """ Returns dates (datetimes or a DatetimeIndex) as an array of epoch seconds, dates without a time zone are
+    taken as UTC.
+    """
+    dates = pd.DatetimeIndex(pd.to_datetime(dates, utc=True))
+    return np.asarray((dates - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1), dtype=np.int64)
+
+
 class ESDLProfileProcessor:
     """
     ESDL Data Store to extract and pre-process profile data into data frames
@@ -43,8 +54,8 @@ class ESDLProfileProcessor:
         self.time_step_notation = '{}s'.format(int(ts))
         self.time_range = pd.date_range(self.start_date, self.end_date, freq=self.time_step_notation)
         self.data_frames = None
-        self.asset_data = {}
-        self.data_cache = {}
+        # Unscaled query results by query hash, the multipliers are applied on every retrieval
+        self.data_cache = DataFrameCache()
         self.data_type = {}
         self.factor = {
             "ENERGY_IN_WH": 3.6 * 1e3,
@@ -112,6 +123,15 @@ class ESDLProfileProcessor:
             containing_asset_id = containing_asset.id
         else:
             containing_asset_id = profile.id
+        values = self.get_profile_values(profile, containing_asset_id)
+        if values is None:
+            return None
+        return pd.DataFrame({containing_asset_id: values}, index=self.time_range)
+
+    def get_profile_values(self, profile: esdl.GenericProfile, containing_asset_id=None) -> Union[np.ndarray, None]:
+        """ Returns the values of a profile in Joules on the simulation time grid (self.time_range) as a float64
+        array, NaN where the profile has no value. None if the profile type is not supported.
+        """
         to_si_multiplier = self.to_joules(profile)
 
         if isinstance(profile, ProfileReference):
@@ -150,65 +170,113 @@ class ESDLProfileProcessor:
                     profile_host = profile_host[7:]
                 if profile.port == 443:
                     ssl_setting = True
-                if profile.startDate is not None:
-                    profile_start_date = profile.startDate.isoformat()
-                else:
-                    profile_start_date = self.start_date.isoformat()
-                if profile.endDate is not None:
-                    end_date_suffix = " AND time <= '{}'".format(profile.endDate.isoformat())
-                else:
-                    end_date_suffix = " AND time <= '{}'".format(self.end_date.isoformat())
-                if profile.filters is not None and profile.filters != '':
-                    filter_suffix = " AND {}".format(profile.filters)
-                else:
-                    filter_suffix = ""
-                query = 'SELECT {}("{}") FROM "{}" WHERE time >= \'{}\'{}{} GROUP BY time({})'.format(
-                    agg_op,
-                    profile.field,
-                    profile.measurement,
-                    profile_start_date,
-                    end_date_suffix,
-                    filter_suffix,
-                    self.time_step_notation)
-                query_hash = hashlib.sha256(query.encode("utf-8")).hexdigest()
-                log.debug('InfluxDB query: {} on {}'.format(query, influx_host))
-                if query_hash not in self.data_cache:
+                profile_start_date = profile.startDate if profile.startDate is not None else self.start_date
+                profile_end_date = profile.endDate if profile.endDate is not None else self.end_date
+                filters = profile.filters if profile.filters else None
+                query_hash = hashlib.sha256(json.dumps(
+                    [influx_host, profile.database, profile.measurement, profile.field, agg_op,
+                     str(profile_start_date), str(profile_end_date), filters, self.time_step_notation]
+                ).encode("utf-8")).hexdigest()
+                log.debug('InfluxDB profile {}.{} on {}'.format(profile.measurement, profile.field, influx_host))
+                df = self.data_cache.get(query_hash)
+                if df is None:
                     log.debug("Profile not cached. Going to query InfluxDB.")
                     client = InfluxDBClient(host=profile_host, port=profile.port, username=username,
                                             password=password, ssl=ssl_setting, verify_ssl=ssl_setting)
                     client.switch_database(profile.database)
-                    data = client.query(query=query)
-                    data_points = {t[0]: t[1] for t in data.raw["series"][0]["values"]}
-                    df = pd.DataFrame.from_dict(data_points, orient="index")
-                    df.index = pd.to_datetime(df.index)
-                    self.asset_data[containing_asset_id] = df * profile.multiplier * to_si_multiplier
-                    self.data_cache[query_hash] = df
-                    client.close()
+                    try:
+                        values, grid_start = read_influxdb_profile(
+                            client, profile.measurement, profile.field, pd.Timestamp(profile_start_date),
+                            pd.Timestamp(profile_end_date), int(self.time_step.total_seconds()), aggregate=agg_op,
+                            filters=filters)
+                    finally:
+                        client.close()
+                    df = pd.DataFrame({"values": values}, index=pd.to_datetime(
+                        grid_start + np.arange(len(values), dtype=np.int64) * int(self.time_step.total_seconds()),
+                        unit="s", utc=True))
+                    self.data_cache.put(query_hash, df)
                 else:
                     log.debug("Profile cached. Retrieving profile from cache.")
-                    return self.data_cache[query_hash] * profile.multiplier * to_si_multiplier
+                starts = to_epoch_seconds(df.index)
+                values = self.align_profile(starts, starts + int(self.time_step.total_seconds()),
+                                            df["values"].to_numpy(), is_energy_profile)
+                return values * (profile.multiplier * to_si_multiplier)
 
         elif isinstance(profile, esdl.SingleValue):
-            return pd.DataFrame({containing_asset_id: profile.value * to_si_multiplier}, index=self.time_range)
+            return np.full(len(self.time_range), profile.value * to_si_multiplier, dtype=np.float64)
 
         elif isinstance(profile, esdl.DateTimeProfile):
-            df = pd.DataFrame({containing_asset_id: np.NaN}, index=self.time_range)
-            for element in profile.element:
-                df[containing_asset_id][
-                pd.to_datetime(element.from_):pd.to_datetime(element.to)] = element.value * to_si_multiplier
-            return df
+            starts = to_epoch_seconds([e.from_ for e in profile.element])
+            ends = to_epoch_seconds([e.to for e in profile.element])
+            values = np.array([e.value for e in profile.element], dtype=np.float64)
+            order = np.argsort(starts, kind="stable")
+            return self.align_profile(starts[order], ends[order], values[order],
+                                      ESDLProfileProcessor.is_energy(profile)) * to_si_multiplier
 
         elif isinstance(profile, esdl.TimeSeriesProfile):
-            df = pd.DataFrame({containing_asset_id: profile.values},
-                              index=pd.date_range(start=pd.to_datetime(profile.startDateTime),
-                                                  periods=len(profile.values),
-                                                  freq='{}s'.format(profile.timestep)))
-            return df * to_si_multiplier
+            time_step = int(profile.timestep) if profile.timestep else int(self.time_step.total_seconds())
+            start = to_epoch_seconds([profile.startDateTime])[0]
+            starts = start + np.arange(len(profile.values), dtype=np.int64) * time_step
+            values = np.asarray(list(profile.values), dtype=np.float64)
+            return self.align_profile(starts, starts + time_step, values,
+                                      ESDLProfileProcessor.is_energy(profile)) * to_si_multiplier
 
         else:
             log.warning('Unsupported profile type {} for asset {}'.format(profile.__class__, containing_asset_id))
             return None
 
+    def align_profile(self, starts, ends, values, is_energy=False):
+        """ Align a profile given as intervals [starts[i], ends[i]) with values[i] (epoch seconds, sorted by start)
+        to the simulation time grid. A grid step gets the mean of the values of the intervals that start within it,
+        or else the value of the interval that covers the start of the step, or else NaN.
+        :param is_energy: The values are energies per interval: a grid step gets the sum of the parts of the intervals
+                          that overlap it, with the energy of an interval spread evenly over its duration.
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        grid = to_epoch_seconds(self.time_range)
+        grid_ends = grid + int(self.time_step.total_seconds())
+        if len(values) == 0:
+            return np.full(len(grid), np.nan)
+
+        # Sum and number of the (not NaN) values of the intervals that start in every grid step, from cumulative sums
+        known = ~np.isnan(values)
+        sums = np.concatenate(([0.0], np.cumsum(np.where(known, values, 0.0))))
+        counts = np.concatenate(([0], np.cumsum(known)))
+        first = np.searchsorted(starts, grid, side="left")
+        last = np.searchsorted(starts, grid_ends, side="left")
+        number_of_values = counts[last] - counts[first]
+
+        # The interval that covers the start of the grid step
+        covering = np.searchsorted(starts, grid, side="right") - 1
+        is_covered = covering >= 0
+        is_covered[is_covered] = grid[is_covered] < ends[covering[is_covered]]
+        fill = (number_of_values == 0) & is_covered
+
+        if is_energy:
+            aligned = self.get_energy_until(grid_ends, starts, ends, values, sums) - \
+                      self.get_energy_until(grid, starts, ends, values, sums)
+            aligned[fill & np.isnan(values[np.maximum(covering, 0)])] = np.nan
+        else:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                aligned = (sums[last] - sums[first]) / number_of_values
+            aligned[fill] = values[covering[fill]]
+        aligned[(number_of_values == 0) & ~is_covered] = np.nan
+        return aligned
+
+    @staticmethod
+    def get_energy_until(times, starts, ends, values, sums):
+        """ Returns the energy of the intervals [starts[i], ends[i]) up to each of the times, with the energy values[i]
+        of an interval spread evenly over its duration. sums holds the cumulative sums of the (not NaN) values.
+        """
+        interval = np.searchsorted(starts, times, side="right") - 1
+        index = np.maximum(interval, 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            share = np.clip((times - starts[index]) / (ends[index] - starts[index]), 0.0, 1.0)
+        partial = np.where(np.isnan(values[index]), 0.0, values[index]) * share
+        return np.where(interval >= 0, sums[index] + partial, 0.0)
+
     @staticmethod
     def is_energy(profile: esdl.GenericProfile):
         if profile.profileType is not None and profile.profileType != esdl.ProfileTypeEnum.UNDEFINED:
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#  This work is based on original code developed and copyrighted by TNO 2025.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from tno.essim_battery.essim_codec import get_topic_command
+from tno.essim_battery.essim_mqtt_client import ESSIMMQTTClient, WILDCARD_NODE_ID
+from tno.essim_battery.influxdb_connector import close_client_pool
+from tno.shared.log import get_logger
+
+logger = get_logger(__name__)
+
+# The number of threads for the blocking work (loading the config and profiles, writing the results)
+ASYNC_EXECUTOR_WORKERS = int(os.getenv('ASYNC_EXECUTOR_WORKERS', '4'))
+# Messages that load profiles or write results, handled in the executor
+BLOCKING_COMMANDS = {"config", "stop"}
+
+
+class AsyncESSIMMQTTClient(ESSIMMQTTClient):
+    """ An ESSIMMQTTClient that keeps the MQTT network loop free of message handling.
+
+    The paho network loop runs in its own thread and only hands the received messages to an asyncio event loop.
+    There every node has a queue and a worker task that handles its messages in order. createBid and allocate
+    messages are handled on the event loop; config and stop messages, which parse the ESDL, query the profiles and
+    write the results, are handled in a thread pool while the messages of the other nodes continue.
+    """
+
+    def __init__(self, *args, executor_workers=ASYNC_EXECUTOR_WORKERS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.executor_workers = executor_workers
+        self.executor = None
+        self.event_loop = None
+        self.stopped = None
+        # Message queue and worker task per node id
+        self.node_queues = dict()
+        self.node_workers = dict()
+        # The ESDL processor is shared by all nodes, so only one config message is handled at a time
+        self.config_lock = threading.Lock()
+
+    def on_message(self, client, userdata, msg):
+        """ Called from the paho network thread, hands the message to the event loop. """
+        self.event_loop.call_soon_threadsafe(self.enqueue, msg)
+
+    def enqueue(self, msg):
+        node_id = self.get_node_id(msg.topic)
+        if node_id is None or not (node_id in self.node_ids or WILDCARD_NODE_ID in self.node_ids):
+            logger.error(f"Message received for a node that is not hosted: {msg.topic}")
+            return
+        node_queue = self.node_queues.get(node_id)
+        if node_queue is None:
+            node_queue = self.node_queues[node_id] = asyncio.Queue()
+            self.node_workers[node_id] = self.event_loop.create_task(self.node_worker(node_queue))
+        node_queue.put_nowait(msg)
+
+    async def node_worker(self, node_queue):
+        while True:
+            msg = await node_queue.get()
+            if msg is None:
+                break
+            if get_topic_command(msg.topic) in BLOCKING_COMMANDS:
+                await self.event_loop.run_in_executor(self.executor, self.handle_blocking_message, msg)
+            else:
+                self.handle_message(msg)
+
+    def handle_message(self, msg):
+        super().on_message(self.client, None, msg)
+
+    def handle_blocking_message(self, msg):
+        if get_topic_command(msg.topic) == "config":
+            with self.config_lock:
+                self.handle_message(msg)
+        else:
+            self.handle_message(msg)
+
+    async def run(self):
+        self.event_loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        with ThreadPoolExecutor(max_workers=self.executor_workers, thread_name_prefix="ESSIMExecutor") as executor:
+            self.executor = executor
+            self.client.loop_start()
+            try:
+                await self.stopped.wait()
+            finally:
+                self.client.disconnect()
+                self.client.loop_stop()
+                await self.drain()
+
+    async def drain(self):
+        """ Handle the queued messages and stop the node workers. """
+        for node_queue in self.node_queues.values():
+            node_queue.put_nowait(None)
+        if self.node_workers:
+            await asyncio.gather(*self.node_workers.values())
+
+    def stop(self):
+        """ Stop the client, can be called from any thread. """
+        self.event_loop.call_soon_threadsafe(self.stopped.set)
+
+    def loop(self):
+        try:
+            asyncio.run(self.run())
+        except KeyboardInterrupt:
+            print("")
+        finally:
+            close_client_pool()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#  This work is based on original code developed and copyrighted by TNO 2025.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+import json
+import struct
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# A bid message is a big-endian int64 timestamp followed by (price, energy) pairs of doubles
+BID_HEADER = struct.Struct(">q")
+BID_POINT = struct.Struct(">dd")
+MAX_BID_CURVE_POINTS = 6
+
+
+def decode_payload(payload):
+    """ Decode a JSON MQTT payload (bytes) without an intermediate str, using orjson when it is installed. """
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+def get_topic_command(topic):
+    """ Returns the last part of the topic, e.g. 'createBid' for essim/node/BATT1/createBid. """
+    return topic.rpartition("/")[2]
+
+
+class BidEncoder:
+    """ Encodes bid curves into the binary ESSIM bid format using one preallocated buffer.
+    """
+
+    def __init__(self, max_points=MAX_BID_CURVE_POINTS):
+        self.buffer = bytearray(BID_HEADER.size + max_points * BID_POINT.size)
+        self.view = memoryview(self.buffer)
+
+    def encode(self, timestamp, bid_curve):
+        """ Encode a bid curve.
+        :param timestamp: The timestamp of the createBid message.
+        :param bid_curve: A sequence of (price, energy) points.
+        :return: The message as bytes. The buffer itself is reused, so a copy is returned that can be queued safely.
+        """
+        BID_HEADER.pack_into(self.buffer, 0, timestamp)
+        offset = BID_HEADER.size
+        for point in bid_curve:
+            BID_POINT.pack_into(self.buffer, offset, point[0], point[1])
+            offset += BID_POINT.size
+        return bytes(self.view[:offset])
+
+
+def decode_bid(payload):
+    """ Decode a binary bid message into its timestamp and list of [price, energy] points. """
+    timestamp = BID_HEADER.unpack_from(payload, 0)[0]
+    bid_curve = [list(point) for point in BID_POINT.iter_unpack(memoryview(payload)[BID_HEADER.size:])]
+    return timestamp, bid_curve
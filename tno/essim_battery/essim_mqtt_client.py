@@ -13,30 +13,29 @@
 #  Manager:
 #      TNO
 
-import base64
-import json
-import os
-import struct
+import logging
+import time
 import traceback
 from datetime import datetime
-from urllib.parse import urlparse
 
 import paho.mqtt.client as mqtt
 
-from tno.essim_battery.battery_node import BatteryNode
 from tno.essim_battery.enums import ExternalModelState
 from tno.essim_battery.esdl_processor import ESDLProcessor
-from tno.essim_battery.influxdb_connector import InfluxDBConnector
+from tno.essim_battery.essim_codec import BidEncoder, decode_payload, get_topic_command
+from tno.essim_battery.essim_node import DEFAULT_TIME_STEP, ESSIM_DATE_FORMAT, ESSIMNode
+from tno.essim_battery.influxdb_connector import close_client_pool
+from tno.essim_battery.metrics import METRICS_ENABLE, dump_metrics, errors_total, messages_total, phase_seconds, \
+    result_queue_depth, state_transitions_total
 from tno.shared.log import get_logger
 
-ESSIM_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
-
 logger = get_logger(__name__)
 
 R_AIR_INSIDE = 0.13
 R_AIR_OUTSIDE = 0.04
-horizon = int(os.getenv('CONTROLLER_HORIZON', '4'))
-MSO_ENABLE = os.getenv('MSO_ENABLE', 'false')
+
+# Subscribing to this node id hosts every node ESSIM sends messages for
+WILDCARD_NODE_ID = '+'
 
 
 class ESSIMMQTTClient:
@@ -54,41 +53,38 @@ class ESSIMMQTTClient:
         self.mqtt_username = mqtt_username
         self.mqtt_password = mqtt_password
         self.topic = None
-        self.node_id = None
+        self.node_ids = list()
         self.client = None
 
-        # used to store the first timestamp we receive from ESSIM in the createBid message
-        self.start_timestamp = None
-
-        # InfluxDB information
-        self.influxdb_client = None
-        self.start_datetime = None
-        self.end_datetime = None
-        self.simulation_info = dict()
-
-        # ESDL information
+        # ESDL information, parsed once and shared by all hosted nodes
         self.esdl_processor = ESDLProcessor()
-        self.energy_system_id = None
-        self.carriers_info = None
-
-        # Time Window information
-        self.charge_time_windows = None
-        self.discharge_time_windows = None
+        # The simulation and ESDL the profiles were last prefetched for, see prefetch_profiles
+        self.prefetch_key = None
 
         # Scaling node information
         self.env_essim_id = '' if env_essim_id is None else env_essim_id
         self.env_simulation_id = '' if env_simulation_id is None else env_simulation_id
         self.env_model_id = '' if env_model_id is None else env_model_id
 
-        self.scenario_id = None
-        self.simulation_id = None
-        self.battery_node = None
+        # Hosted nodes, by node id
+        self.nodes = dict()
 
-        self.model_state = ExternalModelState.UNINITIALIZED
+        self.bid_encoder = BidEncoder()
+        # Message handlers, by the last part of the topic
+        self.message_handlers = {
+            "config": self.handle_config,
+            "createBid": self.handle_create_bid,
+            "allocate": self.handle_allocate,
+            "stop": self.handle_stop,
+        }
 
     def connect(self, topic, node_id):
+        """ Connect to the MQTT broker.
+        :param topic: The ESSIM base topic.
+        :param node_id: A node id, a list of node ids or '+' to host every node ESSIM sends messages for.
+        """
         self.topic = topic
-        self.node_id = node_id
+        self.node_ids = [node_id] if isinstance(node_id, str) else list(node_id)
 
         self.client = mqtt.Client()
         self.client.on_connect = self.on_connect
@@ -101,137 +97,149 @@ class ESSIMMQTTClient:
 
     def on_connect(self, client, userdata, flags, rc):
         logger.debug("Connected with result code " + str(rc))
-        topic = "{}/node/{}/#".format(self.topic, self.node_id)
-        logger.info("Subscribed to {}".format(topic))
-        self.client.subscribe(topic, qos=2)
+        if WILDCARD_NODE_ID in self.node_ids:
+            node_ids = [WILDCARD_NODE_ID]
+        else:
+            node_ids = self.node_ids
+        topics = ["{}/node/{}/#".format(self.topic, node_id) for node_id in node_ids]
+        logger.info("Subscribed to {}".format(", ".join(topics)))
+        self.client.subscribe([(topic, 2) for topic in topics])
+
+    def get_node(self, node_id):
+        """ Returns the hosted node for node_id, creating it on first use, or None if node_id is not hosted. """
+        node = self.nodes.get(node_id)
+        if node is None and (node_id in self.node_ids or WILDCARD_NODE_ID in self.node_ids):
+            node = ESSIMNode(node_id, self.esdl_processor)
+            self.nodes[node_id] = node
+        return node
+
+    def get_node_id(self, topic):
+        # Topics have the form {topic}/node/{node_id}/...
+        prefix = "{}/node/".format(self.topic)
+        if not topic.startswith(prefix):
+            return None
+        return topic[len(prefix):].split("/", 1)[0]
 
     def on_message(self, client, userdata, msg):
-        logger.debug("==================================================")
-        logger.debug(f"topic: {msg.topic}, model state: {self.model_state}")
         try:
-            if str(msg.topic).endswith("/config"):
-                if self.model_state == ExternalModelState.UNINITIALIZED:
-                    logger.info("Received config message!")
-                    self.model_state = ExternalModelState.RECEIVED_CONFIG
-                    self.start_timestamp = None
-                    logger.debug(msg.payload)
-                    payload_bytes = msg.payload
-                    payload_string = payload_bytes.decode("utf-8")
-                    try:
-                        payload_json = json.loads(payload_string)
-                        self.process_json_payload(payload_json)
-                        self.simulation_info = self.create_simulation_info()
-                        self.carriers_info = self.esdl_processor.get_carriers_for_asset(self.node_id)
-                        asset_info = self.esdl_processor.get_asset_info(self.node_id)
-                        logger.info(f"Asset information: {asset_info}")
-                        self.battery_node = BatteryNode(
-                            asset_info=asset_info,
-                            carriers_info=self.carriers_info,
-                            simulation_info=self.simulation_info,
-                            charge_time_windows=self.charge_time_windows,
-                            discharge_time_windows=self.discharge_time_windows
-                        )
-                        self.model_state = ExternalModelState.WAITING_FOR_BID_REQUEST
-                    except Exception as e:
-                        logger.error(traceback.format_exc())
-                        self.model_state = ExternalModelState.ERROR
-
-            elif str(msg.topic).endswith("/createBid"):
-                # {
-                #     "timeStamp": 1546300800,
-                #     "minPrice": 0,
-                #     "timeStepInSeconds": 3600,
-                #     "maxPrice": 1,
-                #     "carrierId": "29903bc6-f798-4eb8-beb9-48862bec646b"
-                # }
-
-                payload_bytes = msg.payload
-                payload_string = payload_bytes.decode("utf-8")
+            topic = msg.topic
+            node = self.get_node(self.get_node_id(topic))
+            if node is None:
+                logger.error(f"Message received for a node that is not hosted: {topic}")
+                return
+            logger.debug("topic: %s, model state: %s", topic, node.model_state)
+
+            command = get_topic_command(topic)
+            handler = self.message_handlers.get(command)
+            if handler is None:
+                logger.error(f"Unknown command received: {topic}")
+            else:
+                model_state = node.model_state
                 try:
-                    payload_json = json.loads(payload_string)
-                    timestamp = payload_json["timeStamp"]
-                    minprice = payload_json["minPrice"]
-                    duration = payload_json["timeStepInSeconds"]
-                    maxprice = payload_json["maxPrice"]
-                    carrier_id = payload_json["carrierId"]
-
-                    if not self.start_timestamp:
-                        self.start_timestamp = timestamp
-
-                    logger.debug(
-                        f"received createBid ({self.carriers_info[carrier_id]['carrier_type']}): "
-                        f"t={timestamp} ({int((timestamp - self.start_timestamp) / 3600)})"
-                        f", d={duration}, pmin={minprice}, pmax={maxprice}")
-                    logger.debug("--------------------------------------------------")
-
-                    step_nr = int((timestamp - self.start_timestamp) / 3600)
-
-                    logger.debug(f"create bidcurve for {self.carriers_info[carrier_id]['carrier_type']}")
-                    # self.building_node.calculate_p_heat(step_nr, duration, carrier_id)
-                    bid_curve = self.battery_node.create_bid_curve(step_nr, timestamp, duration, minprice, maxprice,
-                                                                   carrier_id, )
-
-                    response = struct.pack(">q", timestamp)
-                    for b in bid_curve:
-                        response = response + struct.pack(">dd", b[0], b[1])
-
-                    logger.debug(
-                        f"send ({self.carriers_info[carrier_id]['carrier_type']}): t={timestamp}, points={bid_curve}")
-                    client.publish(
-                        "{}/simulation/{}/{}/bid".format(self.topic, self.node_id, carrier_id),
-                        response)
-
-                    self.model_state = ExternalModelState.WAITING_FOR_ALLOCATION
+                    handler(client, node, msg.payload)
                 except Exception as e:
                     logger.error(traceback.format_exc())
-            elif str(msg.topic).endswith("/allocate"):
-                # {
-                #     "timeStamp": 1546387200,
-                #     "price": 1,
-                #     "carrierId": "29903bc6-f798-4eb8-beb9-48862bec646b"
-                # }
-                self.model_state = ExternalModelState.WAITING_FOR_BID_REQUEST
-
-                payload_bytes = msg.payload
-                payload_string = payload_bytes.decode("utf-8")
-                try:
-                    payload_json = json.loads(payload_string)
-                    timestamp = payload_json["timeStamp"]
-                    price = payload_json["price"]
-                    carrier_id = payload_json["carrierId"]
-                    logger.debug(
-                        f"Received allocation ({self.carriers_info[carrier_id]['carrier_type']}): "
-                        f"price {price} for timestamp t={timestamp} "
-                        f"({int((timestamp - self.start_timestamp) / 3600)})")
-                    # logger.debug(f"carrier_info: {self.carriers_info[carrier_id]}")
-                    logger.debug("--------------------------------------------------")
-                    step_nr = int((timestamp - self.start_timestamp) / 3600)
-                    self.battery_node.process_allocation(step_nr, price, carrier_id)
+                    if METRICS_ENABLE:
+                        errors_total.inc((node.node_id, command))
+                if METRICS_ENABLE:
+                    messages_total.inc((node.node_id, command))
+                    if node.model_state != model_state:
+                        state_transitions_total.inc((node.node_id, model_state.name, node.model_state.name))
+        except Exception as e:
+            logger.error(traceback.format_exc())
 
-                except Exception as e:
-                    logger.error(traceback.format_exc())
-            elif str(msg.topic).endswith("/stop"):
-                # {
-                #     "carrierId": "29903bc6-f798-4eb8-beb9-48862bec646b"
-                # }
-                payload_bytes = msg.payload
-                payload_string = payload_bytes.decode("utf-8")
-                try:
-                    payload_json = json.loads(payload_string)
-                    carrier_id = payload_json["carrierId"]
-                    logger.debug(f"Received stop message ({self.carriers_info[carrier_id]['carrier_name']})")
+    @staticmethod
+    def observe_phases(node, carrier_id, command, timestamps, phases):
+        """ Record the duration of every phase, timestamps has one more element than phases. """
+        for i, phase in enumerate(phases):
+            phase_seconds.observe((node.node_id, carrier_id, command, phase), timestamps[i + 1] - timestamps[i])
 
-                    self.battery_node.write_results(self.influxdb_client, self.simulation_id, self.start_timestamp)
-                    self.model_state = ExternalModelState.UNINITIALIZED
-                    logger.info("Done")
-                except Exception as e:
-                    logger.error(traceback.format_exc())
+    def handle_config(self, client, node, payload):
+        if node.model_state == ExternalModelState.UNINITIALIZED:
+            logger.debug(payload)
+            t0 = time.perf_counter()
+            try:
+                payload_json = decode_payload(payload)
+            except Exception as e:
+                node.model_state = ExternalModelState.ERROR
+                raise
+            t1 = time.perf_counter()
+            self.prefetch_profiles(payload_json)
+            t2 = time.perf_counter()
+            node.process_config(payload_json)
+            if METRICS_ENABLE:
+                self.observe_phases(node, "", "config", (t0, t1, t2, time.perf_counter()),
+                                    ("decode", "prefetch", "config"))
+
+    def prefetch_profiles(self, payload_json):
+        """ Fetch the InfluxDB profiles of every hosted node concurrently when the first config message of a
+        simulation arrives, so the config messages of the other nodes find their profiles ready.
+        """
+        config = payload_json.get("config", {})
+        prefetch_key = (payload_json.get("simulationId"), payload_json.get("esdlContents"),
+                        config.get("startDate"), config.get("timeStepInSeconds"))
+        if prefetch_key == self.prefetch_key:
+            return
+        self.prefetch_key = prefetch_key
+        try:
+            esdl_string = ESSIMNode.get_esdl_string(payload_json)
+            if esdl_string is None:
+                return
+            self.esdl_processor.load_string(esdl_string)
+            if WILDCARD_NODE_ID in self.node_ids:
+                asset_ids = self.esdl_processor.get_battery_ids()
             else:
-                logger.error(f"Unknown command received: {msg.topic}")
+                asset_ids = self.node_ids
+            if "startDate" not in config:
+                return
+            start_timestamp = int(datetime.strptime(config["startDate"], ESSIM_DATE_FORMAT).timestamp())
+            time_step = config.get("timeStepInSeconds")
+            self.esdl_processor.prefetch_profiles(asset_ids, int(time_step) if time_step else DEFAULT_TIME_STEP,
+                                                  start_timestamp)
         except Exception as e:
-            logger.error(traceback.format_exc())
-
-        logger.debug('^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^')
+            # The profiles are queried per node when they are not prefetched
+            logger.warning(f"Prefetching profiles failed: {e}")
+
+    def handle_create_bid(self, client, node, payload):
+        t0 = time.perf_counter()
+        payload_json = decode_payload(payload)
+        t1 = time.perf_counter()
+        timestamp, carrier_id, bid_curve = node.create_bid(payload_json)
+        t2 = time.perf_counter()
+        response = self.bid_encoder.encode(timestamp, bid_curve)
+        t3 = time.perf_counter()
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("send (%s): t=%s, points=%s", node.carriers_info[carrier_id]['carrier_type'], timestamp,
+                         bid_curve)
+        client.publish("{}/simulation/{}/{}/bid".format(self.topic, node.node_id, carrier_id), response)
+        if METRICS_ENABLE:
+            self.observe_phases(node, carrier_id, "createBid", (t0, t1, t2, t3, time.perf_counter()),
+                                ("decode", "create_bid", "encode", "publish"))
+
+    def handle_allocate(self, client, node, payload):
+        t0 = time.perf_counter()
+        payload_json = decode_payload(payload)
+        t1 = time.perf_counter()
+        node.allocate(payload_json)
+        if METRICS_ENABLE:
+            self.observe_phases(node, payload_json["carrierId"], "allocate", (t0, t1, time.perf_counter()),
+                                ("decode", "allocate"))
+            if node.battery_node.result_writer is not None:
+                result_queue_depth.set((node.node_id, ), node.battery_node.result_writer.queue_depth())
+
+    def handle_stop(self, client, node, payload):
+        t0 = time.perf_counter()
+        payload_json = decode_payload(payload)
+        t1 = time.perf_counter()
+        try:
+            node.stop(payload_json)
+        finally:
+            if METRICS_ENABLE:
+                self.observe_phases(node, payload_json["carrierId"], "stop", (t0, t1, time.perf_counter()),
+                                    ("decode", "write_results"))
+                result_queue_depth.set((node.node_id, ), 0)
+                dump_metrics(node.node_id)
 
     def loop(self):
         try:
@@ -239,71 +247,5 @@ class ESSIMMQTTClient:
         except KeyboardInterrupt:
             self.client.disconnect()
             print("")
-
-    def process_json_payload(self, json_payload):
-        if "esdlContents" in json_payload:
-            esdlstr_base64 = json_payload["esdlContents"]
-            esdlstr_bytes = esdlstr_base64.encode("ascii")
-            esdlstr_base64_bytes = base64.b64decode(esdlstr_bytes)
-            esdlstr = esdlstr_base64_bytes.decode("ascii")
-            self.esdl_processor.load_string(esdlstr)
-            self.energy_system_id = self.esdl_processor.energy_system.id
-        if "simulationId" in json_payload:
-            self.simulation_id = json_payload["simulationId"]
-        if "config" in json_payload:
-            try:
-                if "scenarioID" in json_payload["config"]:
-                    self.scenario_id = json_payload["config"]["scenarioID"]
-                else:
-                    self.scenario_id = self.energy_system_id
-                if "influxUrl" in json_payload["config"]:
-                    influx_url = urlparse(json_payload["config"]["influxUrl"])
-                    influx_host = influx_url.hostname
-                    influx_port = influx_url.port
-
-                    self.influxdb_client = InfluxDBConnector(influx_host, influx_port, self.scenario_id)
-                if "startDate" in json_payload["config"]:
-                    self.start_datetime = datetime.strptime(json_payload["config"]["startDate"], ESSIM_DATE_FORMAT)
-                if "endDate" in json_payload["config"]:
-                    self.end_datetime = datetime.strptime(json_payload["config"]["endDate"], ESSIM_DATE_FORMAT)
-                if "chargeTimeWindows" in json_payload["config"]:
-                    self.charge_time_windows = json_payload["config"]["chargeTimeWindows"]
-                else:
-                    self.charge_time_windows = None
-                if "dischargeTimeWindows" in json_payload["config"]:
-                    self.discharge_time_windows = json_payload["config"]["dischargeTimeWindows"]
-                else:
-                    self.discharge_time_windows = None
-            except Exception as e:
-                logger.error(e)
-
-    def get_number_of_ESSIM_simulation_steps(self):
-        if self.start_datetime and self.end_datetime:
-            difference = self.end_datetime - self.start_datetime
-            diff_in_s = difference.total_seconds()
-            diff_in_h = int(divmod(diff_in_s, 3600)[0])
-            return diff_in_h + 1  # Assume hourly simulations
-        else:
-            raise Exception("No start and enddate provided to external model")
-
-    def create_simulation_info(self):
-        return {
-            "stepsize_in_seconds": 3600,  # Assume hourly simulations for now
-            "start_datetime": f"{self.start_datetime.strftime(ESSIM_DATE_FORMAT)}",
-            "end_datetime": f"{self.end_datetime.strftime(ESSIM_DATE_FORMAT)}",
-            "number_of_steps": self.get_number_of_ESSIM_simulation_steps() + 1,
-        }
-
-    def get_profile(self, profile_info):
-        profile = []
-        num_steps = self.get_number_of_ESSIM_simulation_steps()
-        if profile_info["type"] == "SingleValue":
-            for s in range(num_steps):
-                profile.append(profile_info["value"])
-            return profile
-        elif profile_info["type"] == "InfluxDBProfile":
-            return ESDLProcessor.get_influxdb_profile(profile_info)
-        elif profile_info["type"] == "TimeSeriesProfile":
-            return profile_info["values"]
-        else:
-            raise Exception("Unsupported profile type")
+        finally:
+            close_client_pool()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+#  This work is based on original code developed and copyrighted by TNO 2025.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+import base64
+import hashlib
+import json
+import traceback
+from datetime import datetime
+from urllib.parse import urlparse
+
+import numpy as np
+
+from tno.essim_battery.battery_node import MARGINAL_COST_ATTRIBUTES, BatteryNode
+from tno.essim_battery.enums import ExternalModelState
+from tno.essim_battery.esdl_processor import ESDLProcessor
+from tno.essim_battery.influxdb_connector import InfluxDBConnector
+from tno.essim_battery.influxdb_profile_reader import to_epoch
+from tno.essim_battery.result_sinks import INFLUXDB_SINK, RESULT_SINK, create_result_sink
+from tno.essim_battery.result_writer import ResultWriter
+from tno.essim_battery.snapshot import SNAPSHOT_INTERVAL, get_snapshot_path, load_snapshot, remove_snapshot, \
+    save_snapshot
+from tno.shared.log import get_logger, is_trace_step
+
+ESSIM_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+# Used until the time step is known from the config or the first createBid message
+DEFAULT_TIME_STEP = 3600
+
+logger = get_logger(__name__)
+
+
+class ESSIMNode:
+    """ The state of a single external ESSIM node (one battery asset).
+
+    Multiple nodes can be hosted behind one ESSIMMQTTClient connection. Every node keeps its own simulation
+    state, while the ESDLProcessor (and thus the parsed energy system) is shared between all nodes of the client.
+    """
+
+    def __init__(self, node_id, esdl_processor):
+        self.node_id = node_id
+        self.esdl_processor = esdl_processor
+
+        # used to store the first timestamp we receive from ESSIM in the createBid message
+        self.start_timestamp = None
+        # The time step in seconds, from the config or else from the first createBid message
+        self.time_step = None
+        # The time step the profiles in carriers_info have been retrieved for
+        self.profile_time_step = None
+
+        # InfluxDB information
+        self.influxdb_client = None
+        self.start_datetime = None
+        self.end_datetime = None
+        self.simulation_info = dict()
+
+        # ESDL information
+        self.energy_system_id = None
+        self.carriers_info = None
+
+        # Time Window information
+        self.charge_time_windows = None
+        self.discharge_time_windows = None
+
+        self.scenario_id = None
+        self.simulation_id = None
+        self.battery_node = None
+
+        # Snapshots of the simulation state to resume from after a restart, see SNAPSHOT_DIR
+        self.snapshot_path = get_snapshot_path(node_id)
+        self.config_hash = None
+
+        self.model_state = ExternalModelState.UNINITIALIZED
+
+    def process_config(self, payload_json):
+        if self.model_state != ExternalModelState.UNINITIALIZED:
+            return
+
+        logger.info(f"Received config message for node {self.node_id}!")
+        self.model_state = ExternalModelState.RECEIVED_CONFIG
+        self.start_timestamp = None
+        self.time_step = None
+        try:
+            self.process_json_payload(payload_json)
+            self.simulation_info = self.create_simulation_info()
+            # Without a configured time step the profiles are retrieved for DEFAULT_TIME_STEP, and resampled when the
+            # first createBid message has another time step
+            self.carriers_info = self.esdl_processor.get_carriers_for_asset(self.node_id, self.get_time_step(),
+                                                                            self.get_start_timestamp())
+            self.profile_time_step = self.get_time_step()
+            asset_info = self.esdl_processor.get_asset_info(self.node_id)
+            logger.info(f"Asset information: {asset_info}")
+            self.resolve_marginal_costs(asset_info)
+            self.battery_node = BatteryNode(
+                asset_info=asset_info,
+                carriers_info=self.carriers_info,
+                simulation_info=self.simulation_info,
+                charge_time_windows=self.charge_time_windows,
+                discharge_time_windows=self.discharge_time_windows
+            )
+            if self.snapshot_path is not None:
+                self.config_hash = self.get_config_hash(payload_json)
+                self.resume_from_snapshot()
+            self.model_state = ExternalModelState.WAITING_FOR_BID_REQUEST
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            self.model_state = ExternalModelState.ERROR
+
+    def create_bid(self, payload_json):
+        # {
+        #     "timeStamp": 1546300800,
+        #     "minPrice": 0,
+        #     "timeStepInSeconds": 3600,
+        #     "maxPrice": 1,
+        #     "carrierId": "29903bc6-f798-4eb8-beb9-48862bec646b"
+        # }
+        timestamp = payload_json["timeStamp"]
+        minprice = payload_json["minPrice"]
+        duration = payload_json["timeStepInSeconds"]
+        maxprice = payload_json["maxPrice"]
+        carrier_id = payload_json["carrierId"]
+
+        if not self.start_timestamp:
+            self.start_timestamp = timestamp
+            if duration != self.time_step:
+                self.set_time_step(duration)
+            if self.streams_results():
+                self.battery_node.start_result_stream(ResultWriter(self.influxdb_client), self.simulation_id,
+                                                      self.start_timestamp)
+        elif duration != self.time_step:
+            logger.warning(f"Node {self.node_id}: createBid time step {duration}s differs from the simulation time "
+                           f"step {self.time_step}s at t={timestamp}")
+
+        step_nr = self.get_step_nr(timestamp)
+        if is_trace_step(logger, step_nr):
+            logger.debug("received createBid (%s): t=%s (%s), d=%s, pmin=%s, pmax=%s",
+                         self.carriers_info[carrier_id]['carrier_type'], timestamp, step_nr, duration, minprice,
+                         maxprice)
+        bid_curve = self.battery_node.create_bid_curve(step_nr, timestamp, duration, minprice, maxprice, carrier_id)
+
+        self.model_state = ExternalModelState.WAITING_FOR_ALLOCATION
+        return timestamp, carrier_id, bid_curve
+
+    def allocate(self, payload_json):
+        # {
+        #     "timeStamp": 1546387200,
+        #     "price": 1,
+        #     "carrierId": "29903bc6-f798-4eb8-beb9-48862bec646b"
+        # }
+        self.model_state = ExternalModelState.WAITING_FOR_BID_REQUEST
+
+        timestamp = payload_json["timeStamp"]
+        price = payload_json["price"]
+        carrier_id = payload_json["carrierId"]
+        step_nr = self.get_step_nr(timestamp)
+        if is_trace_step(logger, step_nr):
+            logger.debug("Received allocation (%s): price %s for timestamp t=%s (%s)",
+                         self.carriers_info[carrier_id]['carrier_type'], price, timestamp, step_nr)
+        allocation = self.battery_node.process_allocation(step_nr, price, carrier_id)
+        if self.snapshot_path is not None and (step_nr + 1) % SNAPSHOT_INTERVAL == 0 and \
+                self.battery_node.is_step_allocated(step_nr):
+            self.save_snapshot(step_nr + 1)
+        return allocation
+
+    def stop(self, payload_json):
+        # {
+        #     "carrierId": "29903bc6-f798-4eb8-beb9-48862bec646b"
+        # }
+        carrier_id = payload_json["carrierId"]
+        logger.debug(f"Received stop message ({self.carriers_info[carrier_id]['carrier_name']})")
+
+        try:
+            self.battery_node.write_results(create_result_sink(self.influxdb_client), self.simulation_id,
+                                            self.start_timestamp)
+        except Exception as e:
+            logger.error(f"Writing the results of node {self.node_id} failed: {traceback.format_exc()}")
+            self.model_state = ExternalModelState.ERROR
+            return
+        if self.snapshot_path is not None:
+            # The simulation is complete, a new run with the same simulation id starts from the beginning
+            remove_snapshot(self.snapshot_path)
+        self.model_state = ExternalModelState.UNINITIALIZED
+        logger.info(f"Done (node {self.node_id})")
+
+    def streams_results(self):
+        """ InfluxDB results are written while the simulation runs, other result sinks get them when it stops. """
+        return self.influxdb_client is not None and RESULT_SINK == INFLUXDB_SINK
+
+    def get_config_hash(self, payload_json):
+        """ Returns a hash of the energy system and the config, a snapshot is only used for the same hash. """
+        config = json.dumps({"esdl": self.esdl_processor.esdl_hash, "config": payload_json.get("config")},
+                            sort_keys=True, default=str)
+        return hashlib.sha256(config.encode("utf-8")).hexdigest()
+
+    def save_snapshot(self, number_of_steps):
+        """ Save the state after the first number_of_steps steps. """
+        metadata, arrays = self.battery_node.get_snapshot(number_of_steps)
+        metadata.update({
+            "node_id": self.node_id,
+            "simulation_id": self.simulation_id,
+            "config_hash": self.config_hash,
+            "start_timestamp": self.start_timestamp,
+            "time_step": self.time_step,
+        })
+        try:
+            save_snapshot(self.snapshot_path, metadata, arrays)
+        except Exception as e:
+            logger.error(f"Node {self.node_id}: writing snapshot {self.snapshot_path} failed: {e}")
+
+    def resume_from_snapshot(self):
+        """ Restore the state of a snapshot of the same simulation id and config, after a restart. """
+        snapshot = load_snapshot(self.snapshot_path)
+        if snapshot is None:
+            return
+        metadata, arrays = snapshot
+        if metadata.get("simulation_id") != self.simulation_id or metadata.get("config_hash") != self.config_hash:
+            logger.info(f"Node {self.node_id}: ignoring the snapshot of simulation {metadata.get('simulation_id')}")
+            remove_snapshot(self.snapshot_path)
+            return
+
+        self.start_timestamp = metadata["start_timestamp"]
+        if metadata["time_step"] != self.time_step:
+            self.set_time_step(metadata["time_step"])
+        self.battery_node.restore_snapshot(metadata, arrays)
+        number_of_steps = metadata["number_of_steps"]
+        if self.streams_results():
+            # Points of the steps in the snapshot may not have been written before the restart
+            self.battery_node.start_result_stream(ResultWriter(self.influxdb_client), self.simulation_id,
+                                                  self.start_timestamp)
+            for step_nr in range(number_of_steps):
+                self.battery_node.stream_result(step_nr)
+        logger.info(f"Node {self.node_id}: resumed simulation {self.simulation_id} after step {number_of_steps}")
+
+    def get_time_step(self):
+        return self.time_step if self.time_step else DEFAULT_TIME_STEP
+
+    def set_time_step(self, time_step):
+        """ Use the time step ESSIM sends in the first createBid message, if it differs from the configured one. """
+        if self.time_step:
+            logger.warning(f"Node {self.node_id}: configured time step {self.time_step}s differs from the "
+                           f"createBid time step {time_step}s, using {time_step}s")
+        self.time_step = time_step
+        self.simulation_info.update(self.create_simulation_info())
+        self.battery_node.set_number_of_steps(self.simulation_info["number_of_steps"])
+
+        if self.profile_time_step != time_step:
+            logger.info(f"Node {self.node_id}: resampling profiles from {self.profile_time_step}s to {time_step}s")
+            for carrier_info in self.carriers_info.values():
+                if np.ndim(carrier_info.get("carrier_cost", 0)) > 0:
+                    carrier_info["carrier_cost"] = ESDLProcessor.resample_profile(
+                        carrier_info["carrier_cost"], self.profile_time_step, time_step)
+                if carrier_info["port_profile"] is not None:
+                    carrier_info["port_profile"]["values"] = ESDLProcessor.resample_profile(
+                        carrier_info["port_profile"]["values"], self.profile_time_step, time_step)
+            for attr in MARGINAL_COST_ATTRIBUTES:
+                profile_info = self.battery_node.asset_info.get(attr)
+                if profile_info and "step_values" in profile_info:
+                    profile_info["step_values"] = ESDLProcessor.resample_profile(
+                        profile_info["step_values"], self.profile_time_step, time_step)
+            self.profile_time_step = time_step
+            self.battery_node.resolve_marginal_costs()
+
+    def get_step_nr(self, timestamp):
+        step_nr, drift = divmod(timestamp - self.start_timestamp, self.time_step)
+        if drift:
+            logger.warning(f"Node {self.node_id}: timestamp {timestamp} is {drift}s off the {self.time_step}s time "
+                           f"step grid")
+            step_nr = round((timestamp - self.start_timestamp) / self.time_step)
+        return int(step_nr)
+
+    @staticmethod
+    def get_esdl_string(json_payload):
+        if "esdlContents" not in json_payload:
+            return None
+        esdlstr_base64 = json_payload["esdlContents"]
+        esdlstr_bytes = esdlstr_base64.encode("ascii")
+        esdlstr_base64_bytes = base64.b64decode(esdlstr_bytes)
+        return esdlstr_base64_bytes.decode("ascii")
+
+    def process_json_payload(self, json_payload):
+        esdlstr = self.get_esdl_string(json_payload)
+        if esdlstr is not None:
+            self.esdl_processor.load_string(esdlstr)
+            self.energy_system_id = self.esdl_processor.energy_system.id
+        if "simulationId" in json_payload:
+            self.simulation_id = json_payload["simulationId"]
+        if "config" in json_payload:
+            try:
+                if "scenarioID" in json_payload["config"]:
+                    self.scenario_id = json_payload["config"]["scenarioID"]
+                else:
+                    self.scenario_id = self.energy_system_id
+                if "influxUrl" in json_payload["config"]:
+                    influx_url = urlparse(json_payload["config"]["influxUrl"])
+                    influx_host = influx_url.hostname
+                    influx_port = influx_url.port
+
+                    self.influxdb_client = InfluxDBConnector(influx_host, influx_port, self.scenario_id)
+                if "startDate" in json_payload["config"]:
+                    self.start_datetime = datetime.strptime(json_payload["config"]["startDate"], ESSIM_DATE_FORMAT)
+                if "endDate" in json_payload["config"]:
+                    self.end_datetime = datetime.strptime(json_payload["config"]["endDate"], ESSIM_DATE_FORMAT)
+                if "timeStepInSeconds" in json_payload["config"]:
+                    self.time_step = int(json_payload["config"]["timeStepInSeconds"])
+                if "chargeTimeWindows" in json_payload["config"]:
+                    self.charge_time_windows = json_payload["config"]["chargeTimeWindows"]
+                else:
+                    self.charge_time_windows = None
+                if "dischargeTimeWindows" in json_payload["config"]:
+                    self.discharge_time_windows = json_payload["config"]["dischargeTimeWindows"]
+                else:
+                    self.discharge_time_windows = None
+            except Exception as e:
+                logger.error(e)
+
+    def get_start_timestamp(self):
+        """ Returns the start date of the config in epoch seconds. """
+        if self.start_datetime is None:
+            raise Exception("No start date provided to external model")
+        return int(self.start_datetime.timestamp())
+
+    def get_number_of_ESSIM_simulation_steps(self):
+        if self.start_datetime and self.end_datetime:
+            difference = self.end_datetime - self.start_datetime
+            diff_in_s = difference.total_seconds()
+            diff_in_steps = int(divmod(diff_in_s, self.get_time_step())[0])
+            return diff_in_steps + 1
+        else:
+            raise Exception("No start and enddate provided to external model")
+
+    def create_simulation_info(self):
+        return {
+            "stepsize_in_seconds": self.get_time_step(),
+            "start_datetime": f"{self.start_datetime.strftime(ESSIM_DATE_FORMAT)}",
+            "end_datetime": f"{self.end_datetime.strftime(ESSIM_DATE_FORMAT)}",
+            "number_of_steps": self.get_number_of_ESSIM_simulation_steps() + 1,
+        }
+
+    def resolve_marginal_costs(self, asset_info):
+        """ Load the marginal cost profiles of the asset as 'step_values', at the time step of the profiles. """
+        for attr in MARGINAL_COST_ATTRIBUTES:
+            profile_info = asset_info.get(attr)
+            if profile_info and profile_info["type"] != "SingleValue":
+                profile_info["step_values"] = self.get_profile(profile_info)
+                logger.info(f"Node {self.node_id}: loaded {len(profile_info['step_values'])} values of "
+                            f"{profile_info['type']} {attr}")
+
+    def get_profile(self, profile_info):
+        profile = []
+        num_steps = self.get_number_of_ESSIM_simulation_steps()
+        if profile_info["type"] == "SingleValue":
+            for s in range(num_steps):
+                profile.append(profile_info["value"])
+            return profile
+        elif profile_info["type"] == "InfluxDBProfile":
+            return self.esdl_processor.get_profile_values(profile_info, self.get_time_step(),
+                                                          self.get_start_timestamp())
+        elif profile_info["type"] == "TimeSeriesProfile":
+            if profile_info["startDateTime"] is None:
+                profile_start = self.get_start_timestamp()
+            else:
+                profile_start = to_epoch(profile_info["startDateTime"])
+            return ESDLProcessor.align_time_series(profile_info["values"], profile_info["timestep"] or DEFAULT_TIME_STEP,
+                                                   profile_start, self.get_time_step(), self.get_start_timestamp())
+        else:
+            raise Exception("Unsupported profile type")
@@ -14,8 +14,12 @@
 #      TNO
 
 import os
+import threading
+import time
 
 from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBServerError
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
 
 from tno.shared.log import get_logger
 
@@ -23,21 +27,50 @@ logger = get_logger(__name__)
 
 INFLUX_USER = os.getenv('INFLUX_USER', 'admin')
 INFLUX_PASS = os.getenv('INFLUX_PASS', 'admin')
+INFLUX_BATCH_SIZE = int(os.getenv('INFLUX_BATCH_SIZE', '5000'))
+INFLUX_GZIP = os.getenv('INFLUX_GZIP', 'true').lower() == 'true'
+INFLUX_RETRIES = int(os.getenv('INFLUX_RETRIES', '3'))
+INFLUX_RETRY_BACKOFF = float(os.getenv('INFLUX_RETRY_BACKOFF', '0.5'))
+
+# Errors after which the request is retried on a new connection
+TRANSIENT_ERRORS = (RequestsConnectionError, Timeout, InfluxDBServerError)
+
+# One InfluxDBClient (and thus one pooled HTTP session) per (host, port, database), shared by all connectors
+client_pool = dict()
+client_pool_lock = threading.Lock()
+
+
+def close_client_pool():
+    """ Close the pooled clients, call when the process stops. InfluxDBConnector.close leaves them open. """
+    with client_pool_lock:
+        clients = list(client_pool.values())
+        client_pool.clear()
+    for client in clients:
+        client.close()
 
 
 class InfluxDBConnector:
     """ A connector writes data to an InfluxDB database.
     """
 
-    def __init__(self, influx_server, influx_port, influx_database):
+    def __init__(self, influx_server, influx_port, influx_database, batch_size=INFLUX_BATCH_SIZE, gzip=INFLUX_GZIP,
+                 retries=INFLUX_RETRIES, retry_backoff=INFLUX_RETRY_BACKOFF):
         """ Create an InfluxDB connector.
         :param influx_server: The server that hosts InfluxDB.
         :param influx_port: The port of InfluxDB.
         :param influx_database: The target influx database.
+        :param batch_size: The number of points sent per HTTP request when writing.
+        :param gzip: Compress the HTTP requests and responses with gzip.
+        :param retries: The number of times a request is retried after a transient error.
+        :param retry_backoff: The wait in seconds before the first retry, doubled for every next retry.
         """
         self.influx_server = influx_server.split('//')[-1]
         self.influx_port = influx_port
         self.influx_database = influx_database
+        self.batch_size = batch_size
+        self.gzip = gzip
+        self.retries = retries
+        self.retry_backoff = retry_backoff
 
         logger.debug("influx server: {}".format(self.influx_server))
         logger.debug("influx port: {}".format(self.influx_port))
@@ -46,32 +79,59 @@ class InfluxDBConnector:
         self.client = None
 
     def __connect(self):
-        try:
-            logger.debug("Connecting InfluxDBClient")
-            client = InfluxDBClient(host=self.influx_server, port=self.influx_port, database=self.influx_database,
-                                    username=INFLUX_USER, password=INFLUX_PASS)
-            logger.debug("InfluxDBClient ping: {}".format(client.ping()))
-            self.client = client
-        except Exception as e:
-            logger.debug("Caught exception: {}".format(e))
-            if client is not None:
-                client.close()
-            self.client = None
+        key = (self.influx_server, self.influx_port, self.influx_database)
+        with client_pool_lock:
+            client = client_pool.get(key)
+            if client is None:
+                logger.debug("Connecting InfluxDBClient")
+                client = InfluxDBClient(host=self.influx_server, port=self.influx_port, database=self.influx_database,
+                                        username=INFLUX_USER, password=INFLUX_PASS, gzip=self.gzip)
+                try:
+                    logger.debug("InfluxDBClient ping: {}".format(client.ping()))
+                except Exception as e:
+                    client.close()
+                    raise
+                client_pool[key] = client
+        self.client = client
+
+    def __reconnect(self):
+        # Drop the failed client from the pool, so the next request creates a new one. It is not closed, other
+        # connectors may still be using it and move to the new client after their own failure
+        key = (self.influx_server, self.influx_port, self.influx_database)
+        with client_pool_lock:
+            if self.client is not None and client_pool.get(key) is self.client:
+                del client_pool[key]
+        self.client = None
 
-    def query(self, query):
-        if self.client is None:
-            self.__connect()
+    def __request(self, request):
+        for attempt in range(self.retries + 1):
+            try:
+                if self.client is None:
+                    self.__connect()
+                return request(self.client)
+            except TRANSIENT_ERRORS as e:
+                self.__reconnect()
+                if attempt == self.retries:
+                    raise
+                backoff = self.retry_backoff * 2 ** attempt
+                logger.warning("InfluxDB request failed ({}), retrying in {}s".format(e, backoff))
+                time.sleep(backoff)
 
-        return self.client.query(query)
+    def query(self, query):
+        return self.__request(lambda client: client.query(query))
 
     def write(self, msgs):
-        # if self.client is None:
-        self.__connect()
-
         # Send message to database.
-        self.client.write_points(msgs, database=self.influx_database, time_precision='s')
+        self.__request(lambda client: client.write_points(msgs, database=self.influx_database, time_precision='s',
+                                                          batch_size=self.batch_size))
+
+    def write_lines(self, lines):
+        """ Write points encoded as line protocol, with timestamps in epoch seconds.
+        :param lines: A list of lines, see LineProtocolEncoder.
+        """
+        self.__request(lambda client: client.write_points(lines, database=self.influx_database, time_precision='s',
+                                                          batch_size=self.batch_size, protocol='line'))
 
     def close(self):
-        if self.client:
-            self.client.close()
+        # The pooled connection stays open for other connectors to the same database
         self.client = None
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+#  This work is based on original code developed and copyrighted by TNO 2025.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+import os
+from datetime import timezone
+
+import numpy as np
+
+from tno.shared.log import get_logger
+
+logger = get_logger(__name__)
+
+# The time span of one query when reading a profile from InfluxDB, in seconds (default 30 days)
+PROFILE_CHUNK_SECONDS = int(os.getenv('PROFILE_CHUNK_SECONDS', str(30 * 86400)))
+
+
+def to_epoch(date):
+    """ Returns a datetime as epoch seconds, datetimes without a time zone are taken as UTC. """
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return int(date.timestamp())
+
+
+def get_chunk_bounds(start, end, chunk_seconds, offset=0):
+    """ Split [start, end] (epoch seconds) into windows [a, b) of chunk_seconds, aligned to offset plus multiples of
+    chunk_seconds since the epoch. The last window ends at end and includes it.
+    """
+    bounds = list(range(((start - offset) // chunk_seconds + 1) * chunk_seconds + offset, end + 1, chunk_seconds))
+    return list(zip([start] + bounds, bounds + [None]))
+
+
+def get_grid_start(start, time_step, origin=0):
+    """ Returns the start of the time step that contains start (epoch seconds), on the grid of time steps through
+    origin.
+    """
+    offset = origin % time_step
+    return (start - offset) // time_step * time_step + offset
+
+
+def align_to_start(values, grid_start, start, time_step):
+    """ Returns the values of a profile on a grid from grid_start, from the time step that starts at start.
+    The steps before the start of the profile are NaN. start must be on the same grid as grid_start.
+    """
+    shift = (grid_start - start) // time_step
+    if shift >= 0:
+        return np.concatenate([np.full(shift, np.nan), values])
+    return values[-shift:]
+
+
+def forward_fill(values):
+    """ Replace every NaN by the last value before it that is not NaN. Leading NaNs are kept. """
+    indices = np.where(np.isnan(values), 0, np.arange(len(values)))
+    np.maximum.accumulate(indices, out=indices)
+    return values[indices]
+
+
+def read_influxdb_profile(client, measurement, field, start_date, end_date, time_step, aggregate="MEAN", fill=None,
+                          filters=None, chunk_seconds=PROFILE_CHUNK_SECONDS, origin=0):
+    """ Read a profile from InfluxDB in queries of chunk_seconds each, so no response holds the whole profile.
+
+    The points are grouped per time step in InfluxDB, and every chunk is written into an array on the time step grid
+    that is allocated once for the whole profile, so the peak memory is about the size of the result.
+    :param client: An InfluxDBClient connected to the database of the profile.
+    :param start_date: The start of the profile (datetime), included.
+    :param end_date: The end of the profile (datetime), included.
+    :param time_step: The points are aggregated per time_step seconds.
+    :param aggregate: The InfluxDB aggregate function, e.g. MEAN or SUM.
+    :param fill: 'previous' to forward fill the time steps without points, else they are NaN.
+    :param filters: An optional InfluxQL condition that is added to the WHERE clause.
+    :param origin: An epoch timestamp on the time step grid, e.g. the start of the simulation.
+    :return: The values as a float64 array, and the epoch timestamp of the first value.
+    """
+    start = to_epoch(start_date)
+    end = to_epoch(end_date)
+    filter_suffix = " AND {}".format(filters) if filters else ""
+    time_step = int(time_step)
+    # Chunks of whole time steps, so every group falls within one chunk
+    chunk_seconds = max(chunk_seconds // time_step, 1) * time_step
+    # InfluxDB starts the groups at the offset plus multiples of the time step since the epoch
+    offset = origin % time_step
+    group_by = "{}s, {}s".format(time_step, offset) if offset else "{}s".format(time_step)
+    grid_start = get_grid_start(start, time_step, origin)
+    values = np.full((end - grid_start) // time_step + 1, np.nan)
+
+    chunk_bounds = get_chunk_bounds(start, end, chunk_seconds, offset)
+    number_of_points = 0
+    for chunk_start, chunk_end in chunk_bounds:
+        end_condition = "time < {}s".format(chunk_end) if chunk_end is not None else "time <= {}s".format(end)
+        query = 'SELECT {}("{}") FROM "{}" WHERE time >= {}s AND {}{} GROUP BY time({})'.format(
+            aggregate, field, measurement, chunk_start, end_condition, filter_suffix, group_by)
+        data = client.query(query=query, epoch='s')
+        series = data.raw.get("series")
+        if not series:
+            continue
+        points = np.array(series[0]["values"], dtype=np.float64).reshape(-1, 2)
+        number_of_points += len(points)
+        indices = (points[:, 0].astype(np.int64) - grid_start) // time_step
+        inside = (indices >= 0) & (indices < len(values))
+        values[indices[inside]] = points[inside, 1]
+        del data, series, points
+
+    if fill == "previous":
+        values = forward_fill(values)
+    logger.debug(f"Read {number_of_points} points of {measurement}.{field} in {len(chunk_bounds)} chunks")
+    return values, grid_start
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#  This work is based on original code developed and copyrighted by TNO 2025.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+import math
+
+import numpy as np
+
+
+def escape_measurement(name):
+    return str(name).replace("\\", "\\\\").replace(",", "\\,").replace(" ", "\\ ")
+
+
+def escape_key(name):
+    """ Escape a tag key, tag value or field key. """
+    return escape_measurement(name).replace("=", "\\=")
+
+
+def escape_format(text):
+    """ Escape the braces of text for use in a str.format template. """
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+class LineProtocolEncoder:
+    """ Encodes rows of float fields of one measurement and tag set as InfluxDB line protocol, with epoch timestamps
+    in seconds (write with time precision 's').
+
+    The escaped measurement, tags and field keys are combined once into a format template, so encoding a row is a
+    single str.format call.
+    """
+
+    def __init__(self, measurement, tags, field_keys):
+        prefix = escape_measurement(measurement) + "".join(
+            f",{escape_key(key)}={escape_key(value)}" for key, value in sorted(tags.items()))
+        fields = ",".join(escape_format(escape_key(key)) + "={}" for key in field_keys)
+        self.template = escape_format(prefix) + " " + fields + " {}"
+        self.field_keys = list(field_keys)
+
+    def encode(self, timestamp, values):
+        """ Returns the line of one row, or None if a value is NaN or infinite. InfluxDB rejects such values, and with
+        them the whole batch of the line.
+        :param timestamp: The epoch timestamp in seconds.
+        :param values: The float value of every field, in the order of field_keys.
+        """
+        if not all(math.isfinite(value) for value in values):
+            return None
+        return self.template.format(*values, timestamp)
+
+    def encode_rows(self, timestamps, values, chunk_size=5000):
+        """ Yields the lines of all rows in lists of at most chunk_size lines.
+        :param timestamps: An array with the epoch timestamp in seconds of every row.
+        :param values: A (rows, fields) array. Rows with a value that is NaN or infinite are left out.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        finite = np.isfinite(values).all(axis=1)
+        if not finite.all():
+            timestamps = np.asarray(timestamps)[finite]
+            values = values[finite]
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        template = self.template
+        for start in range(0, len(timestamps), chunk_size):
+            rows = values[start:start + chunk_size].tolist()
+            yield [template.format(*row, timestamp)
+                   for row, timestamp in zip(rows, timestamps[start:start + chunk_size].tolist())]
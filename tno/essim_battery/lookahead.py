@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#  This work is based on original code developed and copyrighted by TNO 2025.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+import os
+
+import numpy as np
+
+from tno.shared.log import get_logger
+
+logger = get_logger(__name__)
+
+# Enable the look-ahead (multi step optimization) bidding strategy
+MSO_ENABLE = os.getenv('MSO_ENABLE', 'false').lower() == 'true'
+# The number of future steps the look-ahead strategy optimizes over
+CONTROLLER_HORIZON = int(os.getenv('CONTROLLER_HORIZON', '4'))
+# The number of state of charge levels the look-ahead strategy discretizes the capacity into
+LOOKAHEAD_SOC_LEVELS = int(os.getenv('LOOKAHEAD_SOC_LEVELS', '101'))
+
+
+class LookaheadStrategy:
+    """ Sets the charge and discharge price levels of a battery from the expected prices over a horizon.
+
+    The expected prices come from the carrier cost profile. A dynamic program over a discretized state of charge
+    computes the value of the stored energy at the end of the current step, taking into account the (dis)charge
+    rates and the marginal costs of the battery. The charge price level is the marginal value of stored energy
+    minus the marginal costs, the discharge price level is that value plus the marginal costs:
+    - the marginal costs are half the spread between marginalChargeCosts and marginalDischargeCosts per unit
+      charged or discharged
+    - energy left at the end of the horizon is valued at the midpoint of both
+    So without a horizon (or with constant expected prices at the midpoint) the price levels are the marginal
+    charge and discharge costs, as with the static strategy.
+    """
+
+    def __init__(self, capacity, horizon=CONTROLLER_HORIZON, soc_levels=LOOKAHEAD_SOC_LEVELS):
+        """ Create a look-ahead strategy.
+        :param capacity: The capacity of the battery in Joules.
+        :param horizon: The number of future steps to optimize over.
+        :param soc_levels: The number of levels the state of charge is discretized into.
+        """
+        self.capacity = capacity
+        self.horizon = max(horizon, 0)
+        self.soc_levels = max(soc_levels, 2)
+        self.soc_grid = np.linspace(0.0, capacity, self.soc_levels)
+        self.soc_step = capacity / (self.soc_levels - 1)
+
+        # The value function of the last solve, reused while the inputs do not change (e.g. for other carriers
+        # or repeated bid requests in the same step)
+        self.solve_key = None
+        self.value_function = None
+        # The state of charge transitions, rebuilt only when the (dis)charge limits change
+        self.transitions_key = None
+        self.transitions = None
+
+    def get_transitions(self, max_charge, max_discharge):
+        """ Returns the possible changes of the state of charge level in one step, and for every level the level
+        after each change and whether that level exists.
+        """
+        max_up = int(max_charge // self.soc_step)
+        max_down = int(max_discharge // self.soc_step)
+        if self.transitions_key != (max_up, max_down):
+            moves = np.arange(-max_down, max_up + 1)
+            targets = np.arange(self.soc_levels)[:, None] + moves[None, :]
+            feasible = (targets >= 0) & (targets < self.soc_levels)
+            self.transitions_key = (max_up, max_down)
+            self.transitions = (moves, np.clip(targets, 0, self.soc_levels - 1), feasible)
+        return self.transitions
+
+    def solve(self, expected_prices, mcc, mdc, max_charge, max_discharge):
+        """ Returns the value of every state of charge level at the start of the horizon.
+        :param expected_prices: The expected price of every step in the horizon.
+        :param mcc: The marginal charge costs.
+        :param mdc: The marginal discharge costs.
+        :param max_charge: The maximum energy that can be charged in one step.
+        :param max_discharge: The maximum energy that can be discharged in one step.
+        """
+        key = (tuple(expected_prices), mcc, mdc, max_charge, max_discharge)
+        if key == self.solve_key:
+            return self.value_function
+
+        wear = (mdc - mcc) / 2
+        moves, targets, feasible = self.get_transitions(max_charge, max_discharge)
+        energy = moves * self.soc_step
+        wear_costs = wear * np.abs(energy)
+
+        value = self.soc_grid * (mcc + mdc) / 2
+        for price in reversed(expected_prices):
+            step_rewards = -price * energy - wear_costs
+            candidates = np.where(feasible, step_rewards[None, :] + value[targets], -np.inf)
+            value = candidates.max(axis=1)
+
+        self.solve_key = key
+        self.value_function = value
+        return value
+
+    def get_price_levels(self, state_of_charge, expected_prices, mcc, mdc, max_charge, max_discharge):
+        """ Returns the charge and discharge price levels for the current step.
+        :param state_of_charge: The state of charge at the start of the current step in Joules.
+        :param expected_prices: The expected prices of the steps after the current step, at most horizon values.
+        """
+        if self.horizon == 0 or len(expected_prices) == 0 or self.soc_step <= 0:
+            return mcc, mdc
+
+        value = self.solve(expected_prices, mcc, mdc, max_charge, max_discharge)
+        # The marginal value of stored energy at the current state of charge
+        level = min(int(state_of_charge // self.soc_step), self.soc_levels - 2)
+        marginal_value = (value[level + 1] - value[level]) / self.soc_step
+        wear = (mdc - mcc) / 2
+        return marginal_value - wear, marginal_value + wear
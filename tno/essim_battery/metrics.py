@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+#  This work is based on original code developed and copyrighted by TNO 2025.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+import bisect
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tno.shared.log import get_logger
+
+logger = get_logger(__name__)
+
+# Serve the metrics in the Prometheus text format on this port, no server if empty
+METRICS_PORT = os.getenv('METRICS_PORT', '')
+# Write the metrics to <METRICS_DUMP_DIR>/metrics-<node id>.prom when a simulation stops, no dump if empty
+METRICS_DUMP_DIR = os.getenv('METRICS_DUMP_DIR', '')
+METRICS_ENABLE = bool(METRICS_PORT or METRICS_DUMP_DIR)
+
+LATENCY_BUCKETS = [0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+
+def escape_label_value(value):
+    """ Escape a label value as required by the Prometheus text format. """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(label_names, label_values, extra=""):
+    labels = [f'{name}="{escape_label_value(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Counter:
+    metric_type = "counter"
+
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.values = dict()
+        self.lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with self.lock:
+            for label_values, value in self.values.items():
+                lines.append(f"{self.name}{format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    metric_type = "gauge"
+
+    def set(self, label_values, value):
+        with self.lock:
+            self.values[label_values] = value
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        # Per label values: [count per bucket (the last one is +Inf), sum, count]
+        self.values = dict()
+        self.lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self.lock:
+            entry = self.values.get(label_values)
+            if entry is None:
+                entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label_values, (bucket_counts, total, count) in self.values.items():
+                cumulative = 0
+                for upper_bound, bucket_count in zip(self.buckets + ["+Inf"], bucket_counts):
+                    cumulative += bucket_count
+                    labels = format_labels(self.label_names, label_values, f'le="{upper_bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = format_labels(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = list()
+
+    def counter(self, name, documentation, label_names):
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name, documentation, label_names):
+        return self.register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """ Returns all metrics in the Prometheus text exposition format. """
+        lines = list()
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        logger.info(f"Metrics written to {path}")
+
+
+registry = MetricsRegistry()
+phase_seconds = registry.histogram(
+    "essim_battery_phase_seconds", "Duration of the phases of handling a message",
+    ("node", "carrier", "message", "phase"))
+messages_total = registry.counter(
+    "essim_battery_messages_total", "Number of messages handled", ("node", "message"))
+errors_total = registry.counter(
+    "essim_battery_errors_total", "Number of messages that failed", ("node", "message"))
+state_transitions_total = registry.counter(
+    "essim_battery_state_transitions_total", "Number of model state transitions", ("node", "from_state", "to_state"))
+result_queue_depth = registry.gauge(
+    "essim_battery_result_queue_depth", "Number of result batches waiting to be written", ("node", ))
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def start_metrics_server(port=METRICS_PORT, host="0.0.0.0"):
+    """ Serve the metrics on http://<host>:<port>/metrics from a background thread. """
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, int(port)), MetricsRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True)
+    thread.start()
+    logger.info(f"Serving metrics on port {server.server_address[1]}")
+    return server
+
+
+def dump_metrics(node_id):
+    if METRICS_DUMP_DIR:
+        registry.dump(os.path.join(METRICS_DUMP_DIR, f"metrics-{node_id}.prom"))
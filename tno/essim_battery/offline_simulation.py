@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+#  This work is based on original code developed and copyrighted by TNO 2025.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+# Offline simulation of a battery without ESSIM and MQTT: the createBid / allocate loop is run in-process for a
+# series of market prices, for one or many scenario variants. Run from the repository root with:
+#   python -m tno.essim_battery.offline_simulation <esdl file> <price file> --asset <battery id> --output <dir>
+# See README.md for the options and the scenario file format.
+
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from tno.essim_battery.battery_node import MARGINAL_COST_ATTRIBUTES
+from tno.essim_battery.enums import ExternalModelState
+from tno.essim_battery.esdl_processor import ESDLProcessor
+from tno.essim_battery.essim_node import ESSIM_DATE_FORMAT, ESSIMNode
+from tno.essim_battery.lookahead import LookaheadStrategy
+from tno.shared.log import get_logger
+
+logger = get_logger(__name__)
+
+# Battery attributes a scenario can override
+ASSET_ATTRIBUTES = ["capacity", "fillLevel", "maxChargeRate", "maxDischargeRate", "chargeEfficiency",
+                    "dischargeEfficiency", "selfDischargeRate"]
+
+
+def load_price_series(path, column=None):
+    """ Load the market price of every step from a CSV or Parquet file, or a NumPy .npy file.
+    :param path: The file. CSV files may use ',' or ';' as separator.
+    :param column: The price column, by default the first numeric column.
+    :return: The prices as an array, and the timestamps of the steps (epoch seconds) if the first column of the file
+             contains dates, else None.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".npy":
+        return np.load(path).astype(np.float64), None
+    if extension == ".parquet":
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path, sep=None, engine="python")
+
+    if column is None:
+        numeric_columns = df.select_dtypes(include="number").columns
+        if len(numeric_columns) == 0:
+            raise Exception(f"No numeric price column in {path}")
+        column = numeric_columns[0]
+    prices = df[column].to_numpy(dtype=np.float64)
+
+    timestamps = None
+    first_column = df.iloc[:, 0]
+    if first_column.name != column:
+        try:
+            timestamps = pd.to_datetime(first_column, utc=True).astype("int64").to_numpy() // 10 ** 9
+        except (ValueError, TypeError):
+            timestamps = None
+    return prices, timestamps
+
+
+def apply_scenario(esdl_processor, asset_id, scenario):
+    """ Override the battery attributes and marginal costs in the loaded energy system with those of the scenario. """
+    asset = esdl_processor.esh.get_by_id(asset_id)
+    if asset is None:
+        raise Exception(f"Asset {asset_id} not found in the ESDL")
+    for attr in ASSET_ATTRIBUTES:
+        if attr in scenario:
+            setattr(asset, attr, float(scenario[attr]))
+    for attr in MARGINAL_COST_ATTRIBUTES:
+        if attr in scenario:
+            strategy = esdl_processor.find_control_strategy(asset)
+            if strategy is None or getattr(strategy, attr) is None:
+                raise Exception(f"Asset {asset_id} has no {attr} to override")
+            getattr(strategy, attr).value = float(scenario[attr])
+
+
+def run_scenario(esdl_string, asset_id, prices, start_timestamp, time_step, scenario=None, output_dir=None,
+                 min_price=0.0, max_price=1.0):
+    """ Simulate one battery for a series of market prices.
+    :param esdl_string: The energy system.
+    :param asset_id: The id of the battery in the energy system.
+    :param prices: The market price of every step, the battery is allocated at these prices.
+    :param start_timestamp: The epoch timestamp of the first step.
+    :param time_step: The time step in seconds.
+    :param scenario: A dict with the name of the scenario and the battery attributes, marginal costs,
+                     chargeTimeWindows, dischargeTimeWindows and lookahead setting to override.
+    :param output_dir: If given, the results are written to <output_dir>/<name>.csv (or .parquet, see
+                       the 'format' of the scenario).
+    :return: A summary of the results.
+    """
+    scenario = scenario or dict()
+    name = scenario.get("name", asset_id)
+    prices = np.asarray(prices, dtype=np.float64)
+    number_of_steps = len(prices)
+
+    esdl_processor = ESDLProcessor()
+    esdl_processor.load_string(esdl_string)
+    apply_scenario(esdl_processor, asset_id, scenario)
+
+    end_timestamp = start_timestamp + (number_of_steps - 1) * time_step
+    config = {
+        "startDate": datetime.fromtimestamp(start_timestamp, timezone.utc).strftime(ESSIM_DATE_FORMAT),
+        "endDate": datetime.fromtimestamp(end_timestamp, timezone.utc).strftime(ESSIM_DATE_FORMAT),
+        "timeStepInSeconds": time_step,
+    }
+    for key in ["chargeTimeWindows", "dischargeTimeWindows"]:
+        if key in scenario:
+            config[key] = scenario[key]
+
+    node = ESSIMNode(asset_id, esdl_processor)
+    node.process_config({"simulationId": name, "config": config})
+    if node.model_state == ExternalModelState.ERROR:
+        raise Exception(f"Scenario {name}: configuration failed, see the log")
+    battery_node = node.battery_node
+    if "lookahead" in scenario:
+        battery_node.lookahead = LookaheadStrategy(battery_node.asset_info["capacity"]) \
+            if scenario["lookahead"] else None
+
+    timestamps = start_timestamp + np.arange(number_of_steps) * time_step
+    for timestamp, price in zip(timestamps.tolist(), prices.tolist()):
+        for carrier_id in node.carriers_info:
+            node.create_bid({"timeStamp": timestamp, "minPrice": min_price, "timeStepInSeconds": time_step,
+                             "maxPrice": max_price, "carrierId": carrier_id})
+            node.allocate({"timeStamp": timestamp, "price": price, "carrierId": carrier_id})
+
+    df = pd.DataFrame(battery_node.get_result_columns(number_of_steps),
+                      index=pd.to_datetime(timestamps, unit="s", utc=True))
+    df.index.name = "time"
+    df.insert(0, "price", prices)
+
+    allocations = np.nansum(np.column_stack([battery_node.allocations_energy[c][:number_of_steps]
+                                             for c in battery_node.allocations_energy]), axis=1)
+    summary = {
+        "name": name,
+        "steps": number_of_steps,
+        "charged_energy": float(allocations[allocations > 0].sum()),
+        "discharged_energy": float(-allocations[allocations < 0].sum()),
+        "revenue": float(-(allocations * prices).sum()),
+        "final_state_of_charge": float(battery_node.state_of_charge_in_joules[number_of_steps]),
+    }
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        if scenario.get("format", "csv") == "parquet":
+            path = os.path.join(output_dir, f"{name}.parquet")
+            df.to_parquet(path)
+        else:
+            path = os.path.join(output_dir, f"{name}.csv")
+            df.to_csv(path)
+        summary["path"] = path
+    return summary
+
+
+def run_scenario_kwargs(kwargs):
+    return run_scenario(**kwargs)
+
+
+def run_sweep(esdl_string, asset_id, prices, start_timestamp, time_step, scenarios, output_dir=None,
+              processes=None, **kwargs):
+    """ Run every scenario with run_scenario, spread over a pool of processes.
+    :param processes: The number of processes, by default the number of CPUs. 1 runs the scenarios in this process.
+    :return: A DataFrame with the summary of every scenario.
+    """
+    tasks = [dict(esdl_string=esdl_string, asset_id=asset_id, prices=prices, start_timestamp=start_timestamp,
+                  time_step=time_step, scenario=scenario, output_dir=output_dir, **kwargs)
+             for scenario in scenarios]
+    if processes == 1 or len(tasks) <= 1:
+        summaries = [run_scenario_kwargs(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            summaries = list(executor.map(run_scenario_kwargs, tasks))
+    return pd.DataFrame(summaries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a battery from an ESDL file for a series of prices, "
+                                                 "without ESSIM and MQTT.")
+    parser.add_argument("esdl", help="the ESDL file")
+    parser.add_argument("prices", help="CSV, Parquet or .npy file with the market price of every step")
+    parser.add_argument("--asset", required=True, help="the id of the battery in the ESDL")
+    parser.add_argument("--column", help="the price column, by default the first numeric column")
+    parser.add_argument("--start", help=f"the start of the simulation ({ESSIM_DATE_FORMAT.replace('%', '%%')}), "
+                                        f"by default the first date in the price file")
+    parser.add_argument("--time-step", type=int, help="the time step in seconds, by default the interval of the "
+                                                      "dates in the price file or 3600")
+    parser.add_argument("--scenarios", help="JSON file with a list of scenarios, see README.md")
+    parser.add_argument("--output", default="results", help="the directory to write the results to")
+    parser.add_argument("--processes", type=int, help="the number of processes, by default the number of CPUs")
+    args = parser.parse_args()
+
+    with open(args.esdl, encoding="utf-8") as f:
+        esdl_string = f.read()
+    prices, timestamps = load_price_series(args.prices, args.column)
+
+    if args.start:
+        start_timestamp = int(datetime.strptime(args.start, ESSIM_DATE_FORMAT).timestamp())
+    elif timestamps is not None:
+        start_timestamp = int(timestamps[0])
+    else:
+        raise Exception("No start date given and no dates in the price file")
+    time_step = args.time_step
+    if time_step is None:
+        time_step = int(timestamps[1] - timestamps[0]) if timestamps is not None and len(timestamps) > 1 else 3600
+
+    scenarios = [{"name": args.asset}]
+    if args.scenarios:
+        with open(args.scenarios, encoding="utf-8") as f:
+            scenarios = json.load(f)
+
+    summary = run_sweep(esdl_string, args.asset, prices, start_timestamp, time_step, scenarios, args.output,
+                        args.processes)
+    os.makedirs(args.output, exist_ok=True)
+    summary.to_csv(os.path.join(args.output, "summary.csv"), index=False)
+    print(summary.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+#  This work is based on original code developed and copyrighted by TNO 2025.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from tno.shared.log import get_logger
+
+logger = get_logger(__name__)
+
+# The directory of the profile cache, the cache is disabled if empty. Delete the files in it to invalidate the cache,
+# e.g. after a profile has been uploaded to InfluxDB again
+PROFILE_CACHE_DIR = os.getenv('PROFILE_CACHE_DIR', '')
+PROFILE_CACHE_MAX_BYTES = int(os.getenv('PROFILE_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+# The time to live of a cached profile in seconds, 0 to keep profiles until they are evicted
+PROFILE_CACHE_TTL = float(os.getenv('PROFILE_CACHE_TTL', str(24 * 3600)))
+DATA_FRAME_CACHE_MAX_BYTES = int(os.getenv('DATA_FRAME_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+
+class ProfileCache:
+    """ A content addressed, on-disk cache of profiles, stored as NumPy files and loaded memory-mapped.
+
+    Every entry is one .npy file named after the key. The access time of a file is set on every hit, and the
+    least recently used files are evicted when the total size exceeds max_bytes. Entries older than ttl seconds
+    (when ttl > 0) are ignored and removed. The cache can be shared between processes, and is invalidated by deleting
+    the files in the directory.
+    """
+
+    def __init__(self, directory, max_bytes=PROFILE_CACHE_MAX_BYTES, ttl=PROFILE_CACHE_TTL):
+        """ Create a profile cache.
+        :param directory: The directory to store the profiles in, created if it does not exist.
+        :param max_bytes: The maximum total size of the cached profiles.
+        :param ttl: The time to live of an entry in seconds, 0 to keep entries until they are evicted.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(**key_parts):
+        key_string = json.dumps(key_parts, sort_keys=True, default=str)
+        return hashlib.sha256(key_string.encode("utf-8")).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def get(self, key):
+        """ Returns the cached profile as a read-only memory-mapped array, or None if it is not cached. """
+        path = self.get_path(key)
+        try:
+            stat = os.stat(path)
+            if self.ttl > 0 and time.time() - stat.st_mtime > self.ttl:
+                logger.debug(f"Profile cache entry {key} expired")
+                os.remove(path)
+                return None
+            values = np.load(path, mmap_mode='r')
+            # Mark the entry as recently used, the modification time is kept for the time to live
+            os.utime(path, (time.time(), stat.st_mtime))
+            return values
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable profile cache entry {key}: {e}")
+            return None
+
+    def put(self, key, values):
+        """ Store a profile and return it as it will be returned by get. """
+        values = np.asarray(values, dtype=np.float64)
+        path = self.get_path(key)
+        # Write to a temporary file and rename it, so other processes never read a partially written file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, values)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Could not store profile in cache: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return values
+        self.evict()
+        try:
+            return np.load(path, mmap_mode='r')
+        except FileNotFoundError:
+            # Evicted right away, the profile is larger than the cache
+            return values
+
+    def evict(self):
+        entries = list()
+        total_size = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npy"):
+                stat = entry.stat()
+                entries.append((stat.st_atime, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                logger.debug(f"Evicted {path} from the profile cache")
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+
+class DataFrameCache:
+    """ An in-memory least recently used cache of pandas DataFrames with a byte budget.
+
+    The size of a frame is measured with DataFrame.memory_usage. Frames larger than the budget are not cached.
+    """
+
+    def __init__(self, max_bytes=DATA_FRAME_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """ Returns the cached frame and marks it as most recently used, or None if it is not cached. """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, df):
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key)[1]
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            logger.debug(f"Not caching frame of {size} bytes, the cache budget is {self.max_bytes} bytes")
+            return
+        while self.entries and self.total_bytes + size > self.max_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.total_bytes -= evicted_size
+            self.evictions += 1
+        self.entries[key] = (df, size)
+        self.total_bytes += size
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def get_profile_cache():
+    if not PROFILE_CACHE_DIR:
+        return None
+    try:
+        return ProfileCache(PROFILE_CACHE_DIR)
+    except OSError as e:
+        logger.warning(f"Profile cache disabled, cannot use {PROFILE_CACHE_DIR}: {e}")
+        return None
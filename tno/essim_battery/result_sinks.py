@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#  This work is based on original code developed and copyrighted by TNO 2025.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+import os
+import re
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from tno.essim_battery.influxdb_connector import INFLUX_BATCH_SIZE
+from tno.essim_battery.line_protocol import LineProtocolEncoder
+from tno.shared.log import get_logger
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+logger = get_logger(__name__)
+
+INFLUXDB_SINK = "influxdb"
+PARQUET_SINK = "parquet"
+# Where the results of a simulation are written: influxdb (the influxUrl of the config) or parquet
+RESULT_SINK = os.getenv('RESULT_SINK', INFLUXDB_SINK).lower()
+# The directory the parquet sink writes to
+RESULT_DIR = os.getenv('RESULT_DIR', 'results')
+
+
+class ResultSink(ABC):
+    """ Writes the results of a simulation run, see BatteryNode.write_results. """
+
+    @abstractmethod
+    def write(self, measurement, simulation_run_id, timestamps, columns, bid_curves=None):
+        """ Write the results of the steps of a simulation run.
+        :param measurement: The name of the results, e.g. battery-<asset name>.
+        :param simulation_run_id: The id of the simulation run.
+        :param timestamps: The epoch timestamp of every step as an int64 array.
+        :param columns: A dict with a float64 array of one value per step for every result field.
+        :param bid_curves: An optional dict with a (steps, points, 2) array of the bid curve (price, energy) points of
+                           every step per carrier type, padded with NaN.
+        """
+
+    @abstractmethod
+    def close(self):
+        """ Release the resources of the sink, it is not written to afterwards. """
+
+
+class InfluxDBResultSink(ResultSink):
+    """ Writes the results as InfluxDB points, tagged with the simulation run. The bid curves are not written.
+    The points are encoded as line protocol and written in chunks of the batch size of the InfluxDB client.
+    """
+
+    def __init__(self, influxdb_client, chunk_size=INFLUX_BATCH_SIZE):
+        self.influxdb_client = influxdb_client
+        self.chunk_size = chunk_size
+
+    def write(self, measurement, simulation_run_id, timestamps, columns, bid_curves=None):
+        encoder = LineProtocolEncoder(measurement, {"simulationRun": simulation_run_id}, columns.keys())
+        values = np.column_stack(list(columns.values())) if columns else np.empty((len(timestamps), 0))
+        logger.info(f"InfluxDB writing {len(timestamps)} points to measurement '{measurement}' with tag simulationRun "
+                    f"{simulation_run_id}")
+        for lines in encoder.encode_rows(timestamps, values, self.chunk_size):
+            self.influxdb_client.write_lines(lines)
+
+    def close(self):
+        # The InfluxDB client is owned by the node, which keeps using it for the next simulation
+        pass
+
+
+class ParquetResultSink(ResultSink):
+    """ Writes the results to Parquet files, one per simulation run and measurement:
+    <directory>/simulationRun=<id>/measurement=<measurement>/results.parquet
+
+    The columns are written from the arrays without conversion to rows. The bid curves are written as fixed size
+    list columns <carrier type>_bid_curve_price and <carrier type>_bid_curve_energy. Requires pyarrow.
+    """
+
+    def __init__(self, directory=RESULT_DIR):
+        if pa is None:
+            raise Exception("The parquet result sink requires pyarrow, install it with 'pip install pyarrow'")
+        self.directory = directory
+
+    @staticmethod
+    def get_partition(name, value):
+        return f"{name}={re.sub(r'[^A-Za-z0-9_.-]', '_', str(value))}"
+
+    def write(self, measurement, simulation_run_id, timestamps, columns, bid_curves=None):
+        arrays = [pa.array(np.asarray(timestamps, dtype=np.int64) * 10 ** 9, type=pa.timestamp("ns", tz="UTC"))]
+        names = ["time"]
+        for name, values in columns.items():
+            arrays.append(pa.array(np.asarray(values, dtype=np.float64)))
+            names.append(name)
+        for carrier_type, curves in (bid_curves or dict()).items():
+            number_of_points = curves.shape[1]
+            for i, suffix in enumerate(["price", "energy"]):
+                flat = pa.array(np.ascontiguousarray(curves[:, :, i]).reshape(-1))
+                arrays.append(pa.FixedSizeListArray.from_arrays(flat, number_of_points))
+                names.append(f"{carrier_type}_bid_curve_{suffix}")
+
+        directory = os.path.join(self.directory, self.get_partition("simulationRun", simulation_run_id),
+                                 self.get_partition("measurement", measurement))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "results.parquet")
+        pq.write_table(pa.Table.from_arrays(arrays, names=names), path)
+        logger.info(f"Wrote {len(timestamps)} rows of '{measurement}' for simulationRun {simulation_run_id} to {path}")
+
+    def close(self):
+        # Every write creates and closes its own file
+        pass
+
+
+def create_result_sink(influxdb_client=None, result_sink=RESULT_SINK):
+    """ Returns the configured result sink, or None if the results cannot be written. """
+    if result_sink == PARQUET_SINK:
+        return ParquetResultSink()
+    if result_sink != INFLUXDB_SINK:
+        raise Exception(f"Unknown RESULT_SINK {result_sink}, use {INFLUXDB_SINK} or {PARQUET_SINK}")
+    if influxdb_client is None:
+        return None
+    return InfluxDBResultSink(influxdb_client)
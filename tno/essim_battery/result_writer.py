@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#  This work is based on original code developed and copyrighted by TNO 2025.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+import os
+import queue
+import threading
+import traceback
+
+from tno.shared.log import get_logger
+
+logger = get_logger(__name__)
+
+RESULT_BATCH_SIZE = int(os.getenv('RESULT_BATCH_SIZE', '1000'))
+RESULT_QUEUE_SIZE = int(os.getenv('RESULT_QUEUE_SIZE', '16'))
+# The maximum number of points waiting for a place in the queue, adding points blocks above it
+RESULT_MAX_PENDING = int(os.getenv('RESULT_MAX_PENDING', '100000'))
+
+
+class ResultWriter:
+    """ Writes result points, encoded as line protocol, to InfluxDB in batches from a background thread while the
+    simulation runs.
+
+    Points are collected until a batch is full and then handed to the writer thread through a bounded queue.
+    If the queue is full, the points stay pending and are handed over with the next batch. Only when max_pending
+    points are pending, adding a point blocks until the writer thread has room. close() blocks until all points are
+    written, and raises if some of them could not be written.
+    """
+
+    def __init__(self, influxdb_client, batch_size=RESULT_BATCH_SIZE, queue_size=RESULT_QUEUE_SIZE,
+                 max_pending=RESULT_MAX_PENDING):
+        """ Create a result writer and start its writer thread.
+        :param influxdb_client: The InfluxDBConnector to write the points with.
+        :param batch_size: The number of points written per InfluxDB write.
+        :param queue_size: The maximum number of batches waiting to be written.
+        :param max_pending: The maximum number of points waiting for the queue.
+        """
+        self.influxdb_client = influxdb_client
+        self.batch_size = max(batch_size, 1)
+        self.queue = queue.Queue(maxsize=max(queue_size, 1))
+        self.max_pending = max(max_pending, self.batch_size)
+        self.pending = list()
+        self.points_written = 0
+        self.points_failed = 0
+
+        self.thread = threading.Thread(target=self.run, name="ResultWriter", daemon=True)
+        self.thread.start()
+
+    def add(self, point):
+        self.pending.append(point)
+        if len(self.pending) >= self.batch_size and not self.flush() and len(self.pending) >= self.max_pending:
+            # Wait for the writer thread instead of collecting points without limit
+            logger.debug(f"Result queue full, waiting to write {len(self.pending)} pending points")
+            self.queue.put(self.pending[:self.batch_size])
+            del self.pending[:self.batch_size]
+
+    def flush(self):
+        """ Hand all full batches (and the last partial one) to the writer thread, without blocking.
+        :return: True if no points are pending anymore.
+        """
+        while self.pending:
+            batch = self.pending[:self.batch_size]
+            try:
+                self.queue.put_nowait(batch)
+            except queue.Full:
+                logger.debug(f"Result queue full, {len(self.pending)} points pending")
+                return False
+            del self.pending[:self.batch_size]
+        return True
+
+    def close(self):
+        """ Write all remaining points and stop the writer thread. Blocks until everything is written.
+        Raises an exception if points could not be written, see points_failed.
+        """
+        while self.pending:
+            self.queue.put(self.pending[:self.batch_size])
+            del self.pending[:self.batch_size]
+        self.queue.put(None)
+        self.thread.join()
+        if self.points_failed:
+            raise Exception(f"{self.points_failed} of {self.points_failed + self.points_written} result points "
+                            f"could not be written")
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def run(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                break
+            try:
+                self.influxdb_client.write_lines(batch)
+                self.points_written += len(batch)
+            except Exception as e:
+                self.points_failed += len(batch)
+                logger.error(traceback.format_exc())
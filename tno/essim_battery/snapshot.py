@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#  This work is based on original code developed and copyrighted by TNO 2025.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+import json
+import os
+import re
+import tempfile
+
+import numpy as np
+
+from tno.shared.log import get_logger
+
+logger = get_logger(__name__)
+
+# Write a snapshot of every node to <SNAPSHOT_DIR>/<node id>.npz, no snapshots if empty
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', '')
+# The number of steps between two snapshots
+SNAPSHOT_INTERVAL = int(os.getenv('SNAPSHOT_INTERVAL', '1000'))
+SNAPSHOT_VERSION = 1
+
+
+def get_snapshot_path(node_id, directory=SNAPSHOT_DIR):
+    if not directory:
+        return None
+    return os.path.join(directory, re.sub(r'[^A-Za-z0-9_.-]', '_', node_id) + ".npz")
+
+
+def save_snapshot(path, metadata, arrays):
+    """ Write a snapshot atomically: to a temporary file that then replaces the previous snapshot.
+    :param metadata: A dict that can be stored as JSON.
+    :param arrays: A dict of NumPy arrays by name.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, metadata=np.array(json.dumps({"version": SNAPSHOT_VERSION, **metadata})), **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def load_snapshot(path):
+    """ Returns the metadata and the arrays of a snapshot, or None if there is no (readable) snapshot. """
+    try:
+        with np.load(path, allow_pickle=False) as npz:
+            metadata = json.loads(str(npz["metadata"]))
+            arrays = {name: npz[name] for name in npz.files if name != "metadata"}
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable snapshot {path}: {e}")
+        return None
+    if metadata.get("version") != SNAPSHOT_VERSION:
+        logger.warning(f"Ignoring snapshot {path} of version {metadata.get('version')}")
+        return None
+    return metadata, arrays
+
+
+def remove_snapshot(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
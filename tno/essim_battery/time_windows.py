@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+#  This work is based on original code developed and copyrighted by TNO 2025.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+import numpy as np
+
+SECONDS_PER_HOUR = 3600
+HOURS_PER_DAY = 24
+
+CHARGE_THRESHOLD_KEY = 'always_charge_below_fill_fraction'
+DISCHARGE_THRESHOLD_KEY = 'always_discharge_above_fill_fraction'
+
+
+def get_hour_of_day(timestamp):
+    """ Returns the UTC hour of day of an epoch timestamp in seconds. """
+    return int(timestamp // SECONDS_PER_HOUR % HOURS_PER_DAY)
+
+
+def compile_time_windows(time_windows, threshold_key, no_window_threshold):
+    """ Compile the time windows from the config message into a fill fraction threshold and an hourly lookup table.
+
+    Outside the threshold (above it for charging, below it for discharging) (dis)charging is only allowed in the
+    hours where the lookup table is True.
+    :param time_windows: The chargeTimeWindows or dischargeTimeWindows from the config message, or None.
+    :param threshold_key: CHARGE_THRESHOLD_KEY or DISCHARGE_THRESHOLD_KEY.
+    :param no_window_threshold: The threshold to use without time windows, np.inf for charging and -np.inf for
+                                discharging, so (dis)charging is always allowed.
+    :return: The threshold and a boolean array with 24 elements, one for every UTC hour of the day.
+    """
+    hours = np.zeros(HOURS_PER_DAY, dtype=bool)
+    if not time_windows:
+        return no_window_threshold, hours
+    for window in time_windows['windows']:
+        hours[max(int(window["start_hour"]), 0):max(int(window["end_hour"]), 0)] = True
+    return float(time_windows[threshold_key]), hours
@@ -13,12 +13,65 @@
 #  Manager:
 #      TNO
 
+import atexit
+import logging
+import logging.handlers
 import os
+import queue
 
 import log4p
 
 LOG4P_JSON_LOCATION = os.getenv('LOG4P_JSON_LOCATION', r'../shared/log4p.json')
+# The level of the tno loggers, the same as the tno logger in log4p.json. Messages below it are discarded before they
+# are formatted, set it to DEBUG to log the bid curves and allocations of every step to log4p-debug.log.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# Hand log records to a queue and write them from a background thread, so handler I/O is off the message thread
+LOG_ASYNC = os.getenv('LOG_ASYNC', 'false').lower() == 'true'
+# Only log the per step messages of every Nth simulation step
+LOG_STEP_INTERVAL = max(int(os.getenv('LOG_STEP_INTERVAL', '1')), 1)
+
+configured = False
+queue_listener = None
 
 
 def get_logger(name):
-    return log4p.GetLogger(name, config=LOG4P_JSON_LOCATION).logger
+    """ Returns the logger for name. The log4p configuration is loaded once, by the first call. """
+    global configured
+    if not configured:
+        logger = log4p.GetLogger(name, logging_level=LOG_LEVEL, config=LOG4P_JSON_LOCATION).logger
+        configured = True
+        if LOG_ASYNC:
+            start_async_logging()
+        return logger
+    logger = logging.getLogger(name)
+    logger.setLevel(LOG_LEVEL)
+    return logger
+
+
+def start_async_logging():
+    """ Move the handlers of the root logger behind a queue that is emptied by a background thread. """
+    global queue_listener
+    if queue_listener is not None:
+        return
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    log_queue = queue.SimpleQueue()
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    queue_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    queue_listener.start()
+    atexit.register(stop_async_logging)
+
+
+def stop_async_logging():
+    """ Write the queued log records and stop the background thread. """
+    global queue_listener
+    if queue_listener is not None:
+        queue_listener.stop()
+        queue_listener = None
+
+
+def is_trace_step(logger, step_nr):
+    """ Returns True if the per step DEBUG messages of step_nr should be logged, see LOG_STEP_INTERVAL. """
+    return step_nr % LOG_STEP_INTERVAL == 0 and logger.isEnabledFor(logging.DEBUG)